@@ -1,27 +1,177 @@
 #!/usr/bin/env python
 import sys
+import gzip
+import string
+import numpy as np
+
+# bytes converted at once, blocks are extended to the next name line
+BLOCKSIZE = 1 << 22
+
+# removed from sequence lines: insertions (lower case) and whitespace,
+# 'X' is written as gap
+DELETE = string.ascii_lowercase + string.whitespace
+TRIMMED = string.maketrans('X', '-')
+
+NAME = '\n>sequence0000000/1-100\n'
+# position of the last counter digit in NAME
+LAST_DIGIT = NAME.index('/') - 1
+
+
+def open_alignment(infile):
+
+    """Open plain or gzip compressed alignment file."""
+
+    with open(infile, 'rb') as f:
+        magic = f.read(2)
+    if magic == '\x1f\x8b':
+        return gzip.open(infile, 'rb')
+    return open(infile, 'rb')
+
+
+def read_chunks(aln, blocksize=BLOCKSIZE):
+    return iter(lambda: aln.read(blocksize), '')
+
+
+def get_blocks(chunks, blocksize=BLOCKSIZE):
+
+    """Join chunks of a3m text (e.g. lines) into blocks of whole records.
+    Every block but the first starts with a name line.
+    """
+
+    buf = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= blocksize:
+            data = ''.join(buf)
+            end = data.rfind('\n>') + 1
+            if end > 0:
+                yield data[:end]
+                data = data[end:]
+            buf = [data]
+            size = len(data)
+    data = ''.join(buf)
+    if data:
+        yield data
+
+
+def trim_text(text):
+    # lines in front of the first name line, e.g. a3m title line, are
+    # written like sequence lines
+    trimmed = []
+    for l in text.splitlines():
+        l = l.strip()
+        upperseq = ''.join([c for c in l if not c.islower()])
+        trimmed.append(upperseq.replace('X', '-'))
+    return ''.join(trimmed)
+
+
+def get_rows(blocks):
+
+    """Trimmed rows of a3m blocks: match states only, 'X' as gap.
+    Lines containing a '>' are name lines, every name line starts a row.
+    All whitespace is removed from sequence lines.
+    @raise  ValueError  if a row differs in length from the query (first row)
+    @return generator of (trimmed text in front of the first name line,
+                          np.array((num_rows, query length), uint8),
+                          np.array(num_rows, int64) byte offsets of the name lines)
+    """
+
+    length = -1
+    num_rows = 0
+    offset = 0
+    for block in blocks:
+        block_offset = offset
+        offset += len(block)
+        # every line ends with a newline
+        if not block.endswith('\n'):
+            block += '\n'
+        arr = np.frombuffer(block, dtype=np.uint8)
+        newlines = np.flatnonzero(arr == ord('\n'))
+        name_lines = np.unique(np.searchsorted(newlines, np.flatnonzero(arr == ord('>'))))
+        if len(name_lines) == 0:
+            yield (trim_text(block), np.zeros((0, max(length, 0)), dtype=np.uint8),
+                    np.zeros(0, dtype=np.int64))
+            continue
+
+        # rows from the end of a name line to the start of the next one
+        name_starts = np.r_[0, newlines + 1][name_lines]
+        row_starts = newlines[name_lines].tolist()
+        row_ends = name_starts[1:].tolist() + [len(block)]
+        rows = [block[start:end].translate(TRIMMED, DELETE) for start, end in zip(row_starts, row_ends)]
+        if length < 0:
+            length = len(rows[0])
+        wrong = np.flatnonzero(np.array(map(len, rows)) != length)
+        if len(wrong):
+            raise ValueError('Sequence %d has %d match states, query has %d' %
+                    (num_rows + wrong[0] + 1, len(rows[wrong[0]]), length))
+        num_rows += len(rows)
+        yield (trim_text(block[:name_starts[0]]),
+                np.frombuffer(''.join(rows), dtype=np.uint8).reshape(len(rows), length),
+                name_starts + block_offset)
+    if num_rows == 0:
+        raise ValueError('Alignment contains no sequences')
+
+
+def format_rows(rows, first):
+
+    """Trimmed text of rows with names, rows counted from first > 0."""
+
+    num_rows, length = rows.shape
+    if first + num_rows > 10 ** 7:
+        # counter wider than the name template
+        return ''.join(['\n>sequence{0:07d}/1-100\n'.format(first + k) + row.tostring()
+                for k, row in enumerate(rows)])
+    out = np.empty((num_rows, len(NAME) + length), dtype=np.uint8)
+    out[:, :len(NAME)] = np.frombuffer(NAME, dtype=np.uint8)
+    counter = np.arange(first, first + num_rows)
+    for p in range(7):
+        out[:, LAST_DIGIT - p] = ord('0') + (counter // 10 ** p) % 10
+    out[:, len(NAME):] = rows
+    return out.tostring()
+
+
+def convert_lines(aln):
+
+    """Convert a3m text to trimmed format.
+    @param  aln     chunks of a3m text, e.g. lines of a file
+    @return generator of trimmed text
+    """
+
+    counter = 0
+    for prefix, rows, offsets in get_rows(get_blocks(aln)):
+        yield prefix
+        if len(rows) and counter == 0:
+            yield '>target/1-100\n' + rows[0].tostring()
+            rows = rows[1:]
+            counter = 1
+        if len(rows):
+            yield format_rows(rows, counter)
+            counter += len(rows)
+    yield '\n'
+
 
 def convert(infile):
-    with open(infile) as aln:
-        counter = 0
-        for l in aln:
-            if '>' in l and not counter == 0:
-                yield '\n>sequence{0:07d}/1-100\n'.format(counter)
-                counter += 1
-            elif '>' not in l:
-                l = l.strip()
-                upperseq = ''.join([c for c in l if not c.islower()])
-                upperseq = upperseq.replace('X', '-')
-                yield upperseq
-            elif '>' in l and counter == 0:
-                yield '>target/1-100\n'
-                counter += 1
-        yield '\n'
+
+    """Convert a3m file (plain or gzip compressed) to trimmed format.
+    @return generator of trimmed text
+    """
+
+    aln = open_alignment(infile)
+    try:
+        for l in convert_lines(read_chunks(aln)):
+            yield l
+    finally:
+        aln.close()
 
 
 if __name__ == '__main__':
 
     infile = sys.argv[1]
     outfile_generator = convert(infile)
-    for l in outfile_generator:
-        sys.stdout.write(l)
+    try:
+        for l in outfile_generator:
+            sys.stdout.write(l)
+    except ValueError as e:
+        sys.exit('ERROR: %s' % e)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import sys
+import csv
+import glob
+import signal
+import argparse
+import multiprocessing
+
+import evaluate
+import metrics
+import neff
+
+
+def read_manifest(mfile):
+
+    """Reads batch manifest file.
+    @param  mfile   manifest file, one job per line:
+                    alignment [sequence file [native pdb file]]
+                    empty lines and lines starting with '#' are ignored
+    @return [(alignment, sequence file, native pdb file)]
+    """
+
+    jobs = []
+    for line in mfile:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        line_arr = line.split()
+        line_arr += [''] * (3 - len(line_arr))
+        jobs.append(tuple(line_arr[:3]))
+    return jobs
+
+
+def get_jobs(manifest='', patterns=[]):
+
+    """Collect alignments to evaluate from manifest and/or glob patterns.
+    @return [(alignment, sequence file, native pdb file)]
+    """
+
+    jobs = []
+    if manifest:
+        with open(manifest) as mfile:
+            jobs += read_manifest(mfile)
+    for pattern in patterns:
+        jobs += [(aln_file, '', '') for aln_file in sorted(glob.glob(pattern))]
+    return jobs
+
+
+def init_worker():
+    # let the parent process handle Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_job(job):
+
+    """Evaluate a single alignment, never raise.
+    @param  job     (alignment, sequence file, native pdb file, evaluate kwargs)
+    @return (alignment, stats, error message)
+    """
+
+    aln_file, seq_file, native_file, kwargs = job
+    try:
+        stats = evaluate.evaluate(aln_file, seq_file=seq_file,
+                native_file=native_file, **kwargs)
+    except SystemExit as e:
+        # evaluate() exits on user errors like missing input files
+        return (aln_file, [], str(e))
+    except Exception as e:
+        return (aln_file, [], '%s: %s' % (type(e).__name__, e))
+    return (aln_file, stats, '')
+
+
+def evaluate_batch(jobs, outfile, num_proc=None, **kwargs):
+
+    """Evaluate alignments on a pool of worker processes.
+    Writes one csv row per alignment as soon as it is finished. Failed
+    alignments get empty statistics and the error message in the last column.
+    @param  jobs        [(alignment, sequence file, native pdb file)]
+    @param  outfile     output csv file
+    @param  num_proc    number of worker processes (default=number of cpus)
+    @param  kwargs      passed on to evaluate.evaluate()
+    @return number of failed alignments
+    """
+
+    columns = metrics.get_columns(kwargs.get('metric_names', []))
+    writer = csv.writer(outfile, lineterminator='\n')
+    writer.writerow(['alignment_file'] + columns + ['error'])
+    outfile.flush()
+
+    tasks = [job + (kwargs,) for job in jobs]
+    num_failed = 0
+    pool = multiprocessing.Pool(num_proc, init_worker)
+    try:
+        for aln_file, stats, error in pool.imap_unordered(run_job, tasks):
+            if error:
+                num_failed += 1
+                stats = [''] * len(columns)
+                sys.stderr.write('ERROR: %s: %s\n' % (aln_file, error))
+            writer.writerow([aln_file] + list(stats) + [error])
+            outfile.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return num_failed
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Run alignment quality\
+            evaluation workflow on many alignments in parallel.\nOutputs one\
+            csv row per alignment as soon as it is evaluated.')
+    p.add_argument('-m', '--manifest', default='', help='File with one alignment per line, optionally followed by sequence file and reference pdb file')
+    p.add_argument('-g', '--glob', default=[], action='append', help='Glob pattern of alignment files (can be given multiple times)')
+    p.add_argument('-j', '--jobs', default=None, type=int, help='Number of worker processes (default: number of cpus)')
+    p.add_argument('-c', '--contact', default='', help='Path to contact predictor executable or "gdca" for the built-in GaussDCA')
+    p.add_argument('-w', '--worker', default='', help='Command starting a persistent predictor worker per process, e.g. "julia gdca_worker.jl" (replaces --contact)')
+    p.add_argument('-t', '--threshold', default=0., type=float, help='Contact score threshold')
+    p.add_argument('-r', '--reformat', default='', help='Path to reformat.pl script from HHsuite (default: built-in converter)')
+    p.add_argument('-o', '--output', default='', help='Save output in csv format')
+    p.add_argument('--cachedir', default='', help='Shared cache directory for intermediate files')
+    p.add_argument('--cmversion', default='', help='Version of contact predictor used in cache keys (default: hash of executable)')
+    p.add_argument('-M', '--metrics', default='', help='Comma separated metrics to compute (default: %s)' % ','.join(metrics.DEFAULT_METRICS))
+    p.add_argument('--plugin', default=[], action='append', help='Python file registering additional metrics (can be given multiple times)')
+    p.add_argument('--identity', default=neff.IDENTITY, type=float, help='Sequence identity of similar sequences for the neff metric (default: %g)' % neff.IDENTITY)
+    p.add_argument('--neff-jobs', default=1, type=int, help='Number of threads per worker process computing the neff metric (default: 1)')
+    p.add_argument('--stream', action='store_true', help='Pass trimmed alignments to the built-in GaussDCA ("-c gdca") in memory instead of writing .trimmed files, other predictors still read the files (not with --cachedir or --worker)')
+    p.add_argument('--pipe', action='store_true', help='Pass trimmed alignments to an external contact predictor through named pipes at the .trimmed paths. Only for predictors reading their input exactly once, not run_gdca.sh (not with --cachedir or --worker)')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    # loaded before the worker processes are forked
+    for plugin in args['plugin']:
+        metrics.load_plugin(plugin)
+    metric_names = filter(None, args['metrics'].split(','))
+    try:
+        metrics.get_names(metric_names)
+    except ValueError as e:
+        sys.exit(str(e))
+    jobs = get_jobs(args['manifest'], args['glob'])
+    if not jobs:
+        sys.exit('Please provide a manifest file or glob pattern matching at least one alignment.')
+
+    if args['output']:
+        outfile = open(args['output'], 'w')
+    else:
+        outfile = sys.stdout
+
+    num_failed = evaluate_batch(jobs, outfile, num_proc=args['jobs'],
+            cm_method=args['contact'], reformat_method=args['reformat'],
+            th=args['threshold'], cache_dir=args['cachedir'],
+            cm_version=args['cmversion'], metric_names=metric_names,
+            worker=args['worker'], stream=args['stream'], pipe=args['pipe'],
+            identity=args['identity'], neff_jobs=args['neff_jobs'])
+
+    if outfile is not sys.stdout:
+        outfile.close()
+    if num_failed:
+        sys.stderr.write('%d of %d alignments failed.\n' % (num_failed, len(jobs)))
+        sys.exit(1)
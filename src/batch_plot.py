@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import csv
+import pickle
+import signal
+import argparse
+import multiprocessing
+
+import plot_contact_map
+import parse_contacts
+import residue_map
+import msa_stats
+
+from matplotlib.backends.backend_pdf import PdfPages
+import matplotlib.pyplot as plt
+
+
+# summary table columns taken from plot_contact_map.make_map statistics
+STATS = ['PPV', 'TP', 'FP']
+
+
+def read_manifest(mfile):
+
+    """Reads batch plot manifest file.
+    @param  mfile   manifest file, one target per line:
+                    fasta contacts [pdb [alignment [psipred]]]
+                    '-' for a missing file, empty lines and lines starting
+                    with '#' are ignored
+    @return [(fasta, contacts, pdb, alignment, psipred)]
+    """
+
+    targets = []
+    for line in mfile:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        line_arr = [f if f != '-' else '' for f in line.split()]
+        if len(line_arr) < 2:
+            raise ValueError('Manifest line needs fasta and contact file: %s' % line)
+        line_arr += [''] * (5 - len(line_arr))
+        targets.append(tuple(line_arr[:5]))
+    return targets
+
+
+def get_names(targets):
+
+    """Unique target names: fasta file name without extension, numbered
+    from the second occurrence on."""
+
+    names = []
+    seen = {}
+    for target in targets:
+        name = '.'.join(os.path.basename(target[0]).split('.')[:-1]) or target[0]
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = '%s_%d' % (name, seen[name])
+        names.append(name)
+    return names
+
+
+def init_worker():
+    # let the parent process handle Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def render(job):
+
+    """Draw the contact map of a single target, never raise.
+    @param  job     (name, (fasta, contacts, pdb, alignment, psipred),
+                     png file or '' to return the figure, make_map kwargs)
+    @return (name, statistics, pickled figure or '', error message)
+    """
+
+    name, target, png_filename, kwargs = job
+    fasta_filename, c_filename, pdb_filename, ali_filename, psipred_filename = target
+    if psipred_filename.endswith('.ss2'):
+        psipred = {'psipred_vert_fname': psipred_filename}
+    else:
+        psipred = {'psipred_horiz_fname': psipred_filename}
+    try:
+        fig, stats = plot_contact_map.make_map(fasta_filename, c_filename,
+                pdb_filename=pdb_filename, ali_filename=ali_filename, name=name,
+                sep=parse_contacts.guess_sep(c_filename), **dict(kwargs, **psipred))
+        if png_filename:
+            plot_contact_map.save_map(fig, png_filename)
+            page = ''
+        else:
+            page = pickle.dumps(fig, pickle.HIGHEST_PROTOCOL)
+        plt.close(fig)
+    except Exception as e:
+        return (name, {}, '', '%s: %s' % (type(e).__name__, e))
+    return (name, stats, page, '')
+
+
+def plot_batch(targets, outfilename, summary, num_proc=None, **kwargs):
+
+    """Render contact maps on a pool of worker processes.
+    Pages and summary rows are written in manifest order.
+    @param  targets     [(fasta, contacts, pdb, alignment, psipred)]
+    @param  outfilename multi-page .pdf file, or directory for one .png per target
+    @param  summary     output csv file: name, PPV, TP, FP, error per target
+    @param  num_proc    number of worker processes (default=number of cpus)
+    @param  kwargs      passed on to plot_contact_map.make_map()
+    @return number of failed targets
+    """
+
+    names = get_names(targets)
+    pdf = None
+    if outfilename.endswith('.pdf'):
+        pdf = PdfPages(outfilename)
+        png_filenames = [''] * len(targets)
+    else:
+        if not os.path.isdir(outfilename):
+            os.makedirs(outfilename)
+        png_filenames = [os.path.join(outfilename, '%s.png' % name) for name in names]
+
+    writer = csv.writer(summary, lineterminator='\n')
+    writer.writerow(['name'] + STATS + ['error'])
+    summary.flush()
+
+    jobs = [(name, target, png_filename, kwargs)
+            for name, target, png_filename in zip(names, targets, png_filenames)]
+    num_failed = 0
+    pool = multiprocessing.Pool(num_proc, init_worker)
+    try:
+        for name, stats, page, error in pool.imap(render, jobs):
+            if error:
+                num_failed += 1
+                sys.stderr.write('ERROR: %s: %s\n' % (name, error))
+            elif pdf is not None:
+                fig = pickle.loads(page)
+                pdf.savefig(fig)
+                plt.close(fig)
+            writer.writerow([name] + [stats.get(column, '') for column in STATS] + [error])
+            summary.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if pdf is not None:
+            pdf.close()
+
+    return num_failed
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Plot contact maps of many\
+            targets in parallel into one multi-page pdf file or a directory\
+            of png files.')
+    p.add_argument('manifest', help='File with one target per line: fasta contacts [pdb [alignment [psipred]]], "-" for a missing file')
+    p.add_argument('-o', '--output', required=True, help='Output .pdf file, otherwise directory for png files')
+    p.add_argument('-s', '--summary', default='', help='Save summary table (PPV, TP, FP per target) in csv format (default: stdout)')
+    p.add_argument('-j', '--jobs', default=None, type=int, help='Number of worker processes (default: number of cpus)')
+    p.add_argument('-f', '--factor', default=1.0, type=float)
+    p.add_argument('-t', '--threshold', default=0.5, type=float)
+    p.add_argument('--heavy', action='store_true')
+    p.add_argument('--chain', default='')
+    p.add_argument('--alistat', default='coverage', choices=msa_stats.STATS, help='Alignment column statistic shown next to the map (default: coverage)')
+    p.add_argument('--cachedir', default='', help='Cache directory shared by the worker processes for parsed reference structures and residue mappings')
+    p.add_argument('--aligner', default='pairwise2', choices=sorted(residue_map.ALIGNERS), help='Aligner mapping the sequence onto the structure, "anchored" for long near-identical sequences (default: pairwise2)')
+    p.add_argument('--large', action='store_true', help='Large map mode, see plot_contact_map.py')
+    p.add_argument('--block', default=0, type=int, help='Residues per map pixel (default: 1, with --large at most %d pixels)' % plot_contact_map.MAP_PIXELS)
+    p.add_argument('--pool', default='max', choices=plot_contact_map.POOLS, help='Reduction of the residue pairs of a block: highest ranked pair (FP, TP, 8-12 A, FN) or mean color (default: max)')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    try:
+        with open(args['manifest']) as mfile:
+            targets = read_manifest(mfile)
+    except (IOError, ValueError) as e:
+        sys.exit('ERROR: %s' % e)
+    if not targets:
+        sys.exit('No targets given.')
+
+    if args['summary']:
+        summary = open(args['summary'], 'w')
+    else:
+        summary = sys.stdout
+
+    num_failed = plot_batch(targets, args['output'], summary, num_proc=args['jobs'],
+            factor=args['factor'], th=args['threshold'], is_heavy=args['heavy'],
+            chain=args['chain'], cache_dir=args['cachedir'],
+            ali_stat=args['alistat'], aligner=args['aligner'], large=args['large'],
+            block=args['block'], pool=args['pool'])
+
+    if summary is not sys.stdout:
+        summary.close()
+    if num_failed:
+        sys.stderr.write('%d of %d targets failed.\n' % (num_failed, len(targets)))
+        sys.exit(1)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+
+BLOCKSIZE = 1 << 20
+
+
+def file_hash(filename):
+
+    """Content hash of a file.
+    @param  filename    input file
+    @return sha1 hex digest of the file content
+    """
+
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(BLOCKSIZE)
+        while block:
+            h.update(block)
+            block = f.read(BLOCKSIZE)
+    return h.hexdigest()
+
+
+def tool_version(tool):
+
+    """Identify the version of an external tool or script.
+    @param  tool    path to executable/script or free version string
+    @return content hash for existing files, otherwise the string itself
+    """
+
+    if os.path.isfile(tool):
+        return file_hash(tool)
+    return tool
+
+
+class LRU(object):
+
+    """In-process memo keeping the max_size most recently used entries."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        # move to the most recently used end
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def get_key(*parts):
+
+    """Combine input hash and stage parameters into one cache key.
+    @param  parts   strings identifying input content and parameters
+    @return sha1 hex digest
+    """
+
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def get_path(cache_dir, stage, key):
+
+    """Cache directory holding all artifacts of one stage run."""
+
+    return os.path.join(cache_dir, stage, key[:2], key)
+
+
+def get_artifact(cache_dir, stage, key, filename):
+    return os.path.join(get_path(cache_dir, stage, key), artifact_name(filename))
+
+
+def artifact_name(filename):
+    # artifacts are stored by extension, e.g. "cm" or "gneff"
+    return filename.split('.')[-1]
+
+
+def fetch(cache_dir, stage, key, outfiles):
+
+    """Copy cached artifacts to their target paths.
+    @param  cache_dir   cache root directory
+    @param  stage       pipeline stage name
+    @param  key         cache key as obtained from "get_key"
+    @param  outfiles    target paths, the first one is the main artifact
+    @return True if the main artifact was found in cache
+    """
+
+    main_artifact = get_artifact(cache_dir, stage, key, outfiles[0])
+    if not os.path.isfile(main_artifact) or os.stat(main_artifact).st_size == 0:
+        return False
+    for outfile in outfiles:
+        artifact = get_artifact(cache_dir, stage, key, outfile)
+        if os.path.isfile(artifact):
+            shutil.copyfile(artifact, outfile)
+    return True
+
+
+def store(cache_dir, stage, key, outfiles):
+
+    """Store artifacts of a finished stage in cache.
+    Artifacts are written to a temporary directory first and then moved
+    into place, so concurrent runs never see partially written entries.
+    @param  cache_dir   cache root directory
+    @param  stage       pipeline stage name
+    @param  key         cache key as obtained from "get_key"
+    @param  outfiles    produced files, the first one is the main artifact
+    @return True if artifacts were stored
+    """
+
+    if not os.path.isfile(outfiles[0]) or os.stat(outfiles[0]).st_size == 0:
+        return False
+    path = get_path(cache_dir, stage, key)
+    if os.path.isdir(path):
+        return True
+    tmp_path = make_tmp(cache_dir, stage, key)
+    for outfile in outfiles:
+        if os.path.isfile(outfile):
+            shutil.copyfile(outfile, os.path.join(tmp_path, artifact_name(outfile)))
+    commit(tmp_path, path)
+    return True
+
+
+def make_tmp(cache_dir, stage, key):
+
+    """Create temporary directory next to the final cache entry."""
+
+    parent = os.path.dirname(get_path(cache_dir, stage, key))
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            # created by a concurrent run
+            pass
+    return tempfile.mkdtemp(prefix='.%s.' % key, dir=parent)
+
+
+def commit(tmp_path, path):
+
+    """Move a completely written temporary directory into place."""
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another run stored the same artifacts in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def run_cached(cache_dir, stage, key, outfiles, func, *args, **kwargs):
+
+    """Run a pipeline stage unless its artifacts are in cache.
+    @param  cache_dir   cache root directory
+    @param  stage       pipeline stage name
+    @param  key         cache key as obtained from "get_key"
+    @param  outfiles    files produced by func, the first one is the main artifact
+    @param  func        function running the stage
+    @return True if the artifacts were taken from cache
+    """
+
+    if fetch(cache_dir, stage, key, outfiles):
+        return True
+    func(*args, **kwargs)
+    store(cache_dir, stage, key, outfiles)
+    return False
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+# rows per block, bounds temporary memory to BLOCKSIZE * n * 3 values
+BLOCKSIZE = 256
+
+
+def get_coord_array(gapped_cb_lst):
+
+    """Convert list of coordinates with '-' for gaps into array and mask.
+    @param  gapped_cb_lst   [np.array(3) or '-']
+    @return (np.array((n, 3)), mask), mask is True for residues with coordinates
+    """
+
+    n = len(gapped_cb_lst)
+    coords = np.zeros((n, 3))
+    mask = np.zeros(n, dtype=bool)
+    for i, cb in enumerate(gapped_cb_lst):
+        if isinstance(cb, str):
+            continue
+        coords[i] = cb
+        mask[i] = True
+    return coords, mask
+
+
+def get_cb_contacts(coords, mask=None, dtype=np.float64):
+
+    """Pairwise euclidean distances between residues.
+    @param  coords  np.array((n, 3)) or [np.array(3) or '-'] as before
+    @param  mask    True for residues with coordinates (default: all)
+    @param  dtype   np.float64 or np.float32 to halve memory for large n
+    @return np.array((n, n), dtype), inf for masked residues
+    """
+
+    if not isinstance(coords, np.ndarray):
+        coords, gap_mask = get_coord_array(coords)
+        if mask is None:
+            mask = gap_mask
+    coords = np.asarray(coords, dtype=dtype).reshape(-1, 3)
+    n = coords.shape[0]
+
+    dist_mat = np.empty((n, n), dtype=dtype)
+    for start in range(0, n, BLOCKSIZE):
+        end = min(start + BLOCKSIZE, n)
+        diff = coords[start:end, np.newaxis, :] - coords[np.newaxis, :, :]
+        dist_mat[start:end] = np.sqrt(np.sum(diff * diff, axis=-1))
+
+    if mask is not None:
+        apply_mask(dist_mat, mask)
+    return dist_mat
+
+
+def apply_mask(dist_mat, mask):
+
+    """Set distances of masked residues to inf (in place).
+    @param  dist_mat    np.array((n, n))
+    @param  mask        True for residues to keep
+    """
+
+    gap = ~np.asarray(mask, dtype=bool)
+    dist_mat[gap, :] = float('inf')
+    dist_mat[:, gap] = float('inf')
+    return dist_mat
+
+
+def get_gapped_dist_mat(dist_mat, ali_idx):
+
+    """Distance matrix in the numbering of an aligned sequence.
+    @param  dist_mat    native distance matrix
+    @param  ali_idx     native residue index per sequence position, -1 for gaps
+    @return np.array((len(ali_idx), len(ali_idx))), inf for unaligned positions
+    """
+
+    ali_idx = np.asarray(ali_idx, dtype=int)
+    gapped_dist_mat = np.asarray(dist_mat)[np.ix_(ali_idx, ali_idx)]
+    return apply_mask(gapped_dist_mat, ali_idx >= 0)
+
+
+# neighbour cells of a cell list, each pair of cells is visited once
+HALF_SHELL = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+        for dz in (-1, 0, 1) if (dx, dy, dz) >= (0, 0, 0)]
+
+
+def get_heavy_contacts(coords, res_idx, n=-1, cutoff=5., max_dist=12.):
+
+    """Minimal atom-atom distance between all residue pairs.
+    Atoms are sorted into a grid of cells with edge length max_dist, so only
+    atoms in neighbouring cells are compared.
+    @param  coords      atom coordinates np.array((num_atoms, 3))
+    @param  res_idx     residue index of each atom
+    @param  n           number of residues (default: max(res_idx) + 1)
+    @param  cutoff      contact distance threshold (default=5)
+    @param  max_dist    distances >= max_dist are not computed (default=12)
+    @return (contact map np.array((n, n), bool),
+             distance matrix np.array((n, n)), inf for distances >= max_dist)
+    """
+
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    res_idx = np.asarray(res_idx, dtype=int)
+    if n < 0:
+        n = res_idx.max() + 1 if len(res_idx) > 0 else 0
+    dist_mat = np.empty((n, n))
+    dist_mat.fill(float('inf'))
+    if len(coords) == 0:
+        return dist_mat < cutoff, dist_mat
+
+    cells = np.floor((coords - coords.min(axis=0)) / max_dist).astype(int)
+    dims = cells.max(axis=0) + 1
+    cell_ids = np.ravel_multi_index(cells.T, dims)
+    order = np.argsort(cell_ids, kind='mergesort')
+    ids, starts = np.unique(cell_ids[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    cell_atoms = dict((cid, order[s:e]) for cid, s, e in zip(ids, starts, ends))
+
+    for cid, atoms in cell_atoms.items():
+        cell = np.array(np.unravel_index(cid, dims))
+        for offset in HALF_SHELL:
+            nb_cell = cell + offset
+            if (nb_cell < 0).any() or (nb_cell >= dims).any():
+                continue
+            nb_id = np.ravel_multi_index(nb_cell, dims)
+            if nb_id not in cell_atoms:
+                continue
+            nb_atoms = cell_atoms[nb_id]
+            diff = coords[atoms, np.newaxis, :] - coords[np.newaxis, nb_atoms, :]
+            dist = np.sqrt(np.sum(diff * diff, axis=-1))
+            close_i, close_j = np.nonzero(dist < max_dist)
+            res_i = res_idx[atoms[close_i]]
+            res_j = res_idx[nb_atoms[close_j]]
+            dist = dist[close_i, close_j]
+            np.minimum.at(dist_mat, (res_i, res_j), dist)
+            np.minimum.at(dist_mat, (res_j, res_i), dist)
+
+    return dist_mat < cutoff, dist_mat
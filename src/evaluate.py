@@ -3,7 +3,9 @@
 import sys
 import os
 import argparse
+import signal
 import subprocess
+import threading
 import numpy as np
 
 from itertools import islice
@@ -11,10 +13,20 @@ from itertools import islice
 import ppv
 import plot_contact_map
 import a3m_to_trimmed
-import parse_contacts
+import fasta_index
+import parse_msa
+import reformat
+import metrics
+import neff
+import cache
+import predictor_worker
+import gdca
 
 
 WORKDIR = os.path.dirname(os.path.realpath(__file__))
+COLUMNS = metrics.get_columns(metrics.DEFAULT_METRICS)
+# modules whose code determines the contacts of the built-in GaussDCA
+GDCA_MODULES = ['gdca', 'neff', 'parse_msa']
 
 
 def extract_seq(aln_file):
@@ -24,96 +36,251 @@ def extract_seq(aln_file):
 
 
 def reformat_alignment(aln_file, aln_file_a3m, reformat_method=''):
-    """ Optional STEP 0: Convert alignment to a3m """
+    """ Optional STEP 0: Convert alignment to a3m
+        Built-in converter (reformat.py), format guessed from content,
+        unless the path of HHsuite's reformat.pl is given.
+    """
+    if not reformat_method:
+        try:
+            reformat.reformat(aln_file, aln_file_a3m)
+        except (IOError, ValueError) as e:
+            sys.exit('Could not convert %s to a3m: %s' % (aln_file, e))
+        return
     aln_type = aln_file.split('.')[-1]
     if aln_type == 'fa' or aln_type == 'fasta':
         aln_type = 'fas'
-    if not reformat_method:
-        cmd = ['%s/reformat.pl' % WORKDIR]
-    else:
-        cmd = [reformat_method]
-    cmd += [aln_type, 'a3m', aln_file, aln_file_a3m]
-    subprocess.call(cmd, stdout=open(os.devnull, 'wb'))
+    cmd = [reformat_method, aln_type, 'a3m', aln_file, aln_file_a3m]
+    ret = subprocess.call(cmd, stdout=open(os.devnull, 'wb'))
+    if ret != 0 or not os.path.isfile(aln_file_a3m) or os.stat(aln_file_a3m).st_size == 0:
+        sys.exit('Could not convert %s to a3m: %s exited with code %d' % (aln_file, reformat_method, ret))
 
 
 def trim_alignment(aln_file, trimmed_aln_file):
-    """ STEP 1: convert a3m to trimmed format """
-    outfile_generator = a3m_to_trimmed.convert(aln_file)
-    with open(trimmed_aln_file, 'w') as outf:
-        for l in outfile_generator:
-            outf.write(l)
+    """ STEP 1: convert a3m (or binary alignment, see parse_msa) to trimmed format """
+    if parse_msa.is_msa(aln_file):
+        outfile_generator = parse_msa.get_trimmed(parse_msa.load(aln_file)[0])
+    else:
+        outfile_generator = a3m_to_trimmed.convert(aln_file)
+    try:
+        with open(trimmed_aln_file, 'w') as outf:
+            for l in outfile_generator:
+                outf.write(l)
+    except ValueError as e:
+        # don't leave an incomplete file to be reused
+        if os.path.isfile(trimmed_aln_file):
+            os.remove(trimmed_aln_file)
+        sys.exit('Could not trim %s: %s' % (aln_file, e))
+
 
+def remove_stale_trimmed(trimmed_aln_file):
+    """ Remove a named pipe (or other non-regular file) left at the
+        .trimmed path by a killed stream run, it would block trimming
+    """
+    if os.path.lexists(trimmed_aln_file) and not os.path.isfile(trimmed_aln_file) \
+            and not os.path.isdir(trimmed_aln_file):
+        os.remove(trimmed_aln_file)
 
-def predict_contacts(trimmed_aln_file, cm_file, cm_method=''):
-    """ STEP 2: run given contact prediction method """
-    # default:
+
+def get_predictor_cmd(trimmed_aln_file, cm_file, cm_method=''):
+    """ Command line of an external contact predictor (default: run_gdca.sh) """
     if not cm_method:
         cmd = ['%s/run_gdca.sh' % WORKDIR]
     else:
         cmd = [cm_method]
-    cmd += [trimmed_aln_file, cm_file]
-    subprocess.call(cmd)
+    return cmd + [trimmed_aln_file, cm_file]
+
+
+def predict_contacts(trimmed_aln_file, cm_file, cm_method='', worker=''):
+    """ STEP 2: run given contact prediction method
+        cm_method 'gdca' runs the built-in GaussDCA in this process.
+        With worker, the prediction job is sent to a long-running
+        predictor worker instead, see predictor_worker.py
+    """
+    neff_file = '.'.join(trimmed_aln_file.split('.')[:-1]) + '.gneff'
+    if worker:
+        predictor_worker.get_worker(worker).predict(trimmed_aln_file, cm_file, neff_file)
+        return
+    if cm_method == 'gdca':
+        gdca.predict(trimmed_aln_file, cm_file, neff_file)
+        return
+    subprocess.call(get_predictor_cmd(trimmed_aln_file, cm_file, cm_method))
+
+
+def stream_alignment(aln_file, fifo, errors):
+    try:
+        trim_alignment(aln_file, fifo)
+    except IOError:
+        # predictor closed the pipe before reading everything
+        pass
+    except SystemExit as e:
+        errors.append(str(e))
 
 
-def get_ppv(seq_file, cm_file, native_file):
-    """ STEP 3a: compare contact map to native """
-    result = ppv.get_ppv(seq_file, cm_file, native_file)
-    #plot_contact_map.plot_map(seq_file, cm_file, pdb_filename=native_file)
-    return result[1]
+def terminate(signum, frame):
+    sys.exit('Terminated by signal %d' % signum)
 
 
-def get_numc(cm_file, th=0.):
-    """ STEP 3b: get (normalized) number of contacts above score
-        REMARK: in case of GaussDCA the score is a log-likelihood,
-        => score above 0.0 = more likely to be correct than false
-        Threshold needs to be changed depending on contact predictor.
+def predict_streamed(aln_file, trimmed_aln_file, cm_file, cm_method=''):
+    """ STEP 1 + 2 without writing the .trimmed file
+        The built-in GaussDCA gets the trimmed alignment as array in
+        memory, external predictors read it from a named pipe created at
+        the .trimmed path, so they must read it only once (not
+        run_gdca.sh). The pipe is removed and the predictor killed on
+        any exit, SIGTERM included.
     """
-    contacts = parse_contacts.parse(open(cm_file))
-    contacts_np = parse_contacts.get_numpy_cmap(contacts)
-    numc = len(np.where(contacts_np > th)[0])
-    numc_norm = numc / float(pow(contacts_np.shape[0], 2))
-    return numc, numc_norm
+    if cm_method == 'gdca':
+        try:
+            msa = gdca.from_codes(parse_msa.read_codes(aln_file))
+        except ValueError as e:
+            sys.exit('Could not trim %s: %s' % (aln_file, e))
+        neff_file = '.'.join(trimmed_aln_file.split('.')[:-1]) + '.gneff'
+        gdca.predict(trimmed_aln_file, cm_file, neff_file, msa=msa)
+        return
+    os.mkfifo(trimmed_aln_file)
+    try:
+        # run the finally clause on SIGTERM too (main thread only)
+        prev_handler = signal.signal(signal.SIGTERM, terminate)
+    except ValueError:
+        prev_handler = None
+    errors = []
+    writer = None
+    proc = None
+    try:
+        writer = threading.Thread(target=stream_alignment, args=(aln_file, trimmed_aln_file, errors))
+        writer.daemon = True
+        writer.start()
+        proc = subprocess.Popen(get_predictor_cmd(trimmed_aln_file, cm_file, cm_method))
+        proc.wait()
+    finally:
+        if proc is not None and proc.poll() is None:
+            # interrupted, the predictor may be waiting on the pipe
+            proc.kill()
+            proc.wait()
+        if writer is not None and writer.is_alive():
+            # predictor never opened the pipe or stopped reading, release the writer
+            try:
+                os.close(os.open(trimmed_aln_file, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            writer.join(1)
+        os.remove(trimmed_aln_file)
+        if prev_handler is not None:
+            signal.signal(signal.SIGTERM, prev_handler)
+    if errors:
+        sys.exit(errors[0])
 
 
-def get_maxc(cm_file):
-    """ STEP 3c: get maximal contact score """
-    contacts = parse_contacts.parse(open(cm_file))
-    contacts_np = parse_contacts.get_numpy_cmap(contacts)
-    return np.max(contacts_np)
+def get_query(aln_file):
+    """ Query sequence (first record) of fasta/a3m alignment, read
+        through its offset index without loading the alignment
+    """
+    try:
+        query = fasta_index.load(aln_file).get_query()
+    except (IOError, ValueError, IndexError) as e:
+        sys.exit('Could not read query sequence from %s: %s' % (aln_file, e))
+    return query.translate(None, '-.').upper()
+
+
+def get_metrics(seq_file, cm_file, native_file, th=0., cache_dir='', metric_names=[], seq='', aln_file='', identity=neff.IDENTITY, neff_jobs=1):
+    """ STEP 3: compare contact map to native and score it
+        Contact map and native are parsed once for all selected metrics,
+        see metrics.py (default: PPV, numc, maxc, top_ppv)
+    """
+    data = metrics.load(seq_file, cm_file, native_file, th=th, cache_dir=cache_dir, seq=seq, aln_file=aln_file, identity=identity, neff_jobs=neff_jobs)
+    return metrics.run(data, metric_names)
 
     
-def evaluate(aln_file, seq_file='', native_file='', cm_method='', reformat_method='', th=0.):
-    """ Run evaluation pipeline on given alignment """
+def get_cache_key(stage, in_file, tool, version=''):
+    """ Cache key of a pipeline step: input content + step parameters """
+    if not version:
+        version = cache.tool_version(tool)
+    if os.path.exists(tool):
+        tool = os.path.realpath(tool)
+    return cache.get_key(stage, cache.file_hash(in_file), tool, version)
+
+
+def evaluate(aln_file, seq_file='', native_file='', cm_method='', reformat_method='', th=0., cache_dir='', cm_version='', metric_names=[], worker='', stream=False, pipe=False, identity=neff.IDENTITY, neff_jobs=1):
+    """ Run evaluation pipeline on given alignment
+        If cache_dir is given, intermediate files are looked up by
+        content in the cache instead of by file name.
+        If worker is given, contacts are predicted by a persistent
+        predictor worker started with this command.
+        With stream and cm_method 'gdca', or pipe for an external predictor
+        reading its input once (and neither cache_dir nor worker), no
+        .trimmed file is written, see predict_streamed.
+        Without seq_file (and no sequence file named after the alignment),
+        the query sequence is taken from the a3m alignment.
+        identity is the sequence identity threshold of the neff metric,
+        neff_jobs the number of threads computing it.
+    """
     if not seq_file:
         seq_file = '%s/%s.fa' % (os.path.dirname(aln_file), os.path.basename(aln_file)[:5])
+        if not os.path.isfile(seq_file):
+            seq_file = ''
     if not native_file:
         native_file = '%s/native.pdb' % os.path.dirname(aln_file)
-    if not os.path.isfile(seq_file):
+    if seq_file and not os.path.isfile(seq_file):
         sys.exit('Please provide an existing sequence file.')
     
     # STEP 0
-    if not aln_file.endswith('.a3m'):
+    if not (aln_file.endswith('.a3m') or aln_file.endswith('.a3m.gz') or aln_file.endswith('.msa')):
         aln_file_a3m = '.'.join(aln_file.split('.')[:-1]) + '.a3m'
-        if not os.path.isfile(aln_file_a3m) or os.stat(aln_file_a3m).st_size == 0:
+        if cache_dir:
+            tool = reformat_method or '%s/reformat.py' % WORKDIR
+            key = get_cache_key('reformat', aln_file, tool)
+            cache.run_cached(cache_dir, 'reformat', key, [aln_file_a3m],
+                    reformat_alignment, aln_file, aln_file_a3m, reformat_method)
+        elif not os.path.isfile(aln_file_a3m) or os.stat(aln_file_a3m).st_size == 0:
             reformat_alignment(aln_file, aln_file_a3m, reformat_method)
         aln_file = aln_file_a3m
 
+    seq = ''
+    if not seq_file:
+        if aln_file.endswith('.gz') or aln_file.endswith('.msa'):
+            sys.exit('Please provide an existing sequence file.')
+        seq = get_query(aln_file)
+
     # STEP 1
-    trimmed_aln_file = '.'.join(aln_file.split('.')[:-1]) + '.trimmed'
-    if not os.path.isfile(trimmed_aln_file):
+    if aln_file.endswith('.gz'):
+        trimmed_aln_file = '.'.join(aln_file[:-len('.gz')].split('.')[:-1]) + '.trimmed'
+    else:
+        trimmed_aln_file = '.'.join(aln_file.split('.')[:-1]) + '.trimmed'
+    remove_stale_trimmed(trimmed_aln_file)
+    # only cached trimmed alignments are written to disk in stream mode,
+    # external predictors only get a named pipe when asked for
+    streamed = (stream and cm_method == 'gdca' or pipe) and not cache_dir \
+            and not worker and not os.path.isfile(trimmed_aln_file)
+    if cache_dir:
+        key = get_cache_key('trim', aln_file, '%s/a3m_to_trimmed.py' % WORKDIR)
+        cache.run_cached(cache_dir, 'trim', key, [trimmed_aln_file],
+                trim_alignment, aln_file, trimmed_aln_file)
+    elif not streamed and not os.path.isfile(trimmed_aln_file):
         trim_alignment(aln_file, trimmed_aln_file)
 
     # STEP 2
     cm_file = '.'.join(trimmed_aln_file.split('.')[:-1]) + '.cm'
-    if not os.path.isfile(cm_file) or os.stat(cm_file).st_size == 0:
-        predict_contacts(trimmed_aln_file, cm_file, cm_method=cm_method)
+    if cache_dir:
+        # run_gdca.sh also reports the number of effective sequences
+        neff_file = '.'.join(trimmed_aln_file.split('.')[:-1]) + '.gneff'
+        tool = worker or cm_method or '%s/run_gdca.sh' % WORKDIR
+        if tool == 'gdca':
+            tool = '%s/gdca.py' % WORKDIR
+            if not cm_version:
+                cm_version = cache.get_key(*[cache.file_hash('%s/%s.py' % (WORKDIR, name))
+                        for name in GDCA_MODULES])
+        key = get_cache_key('predict', trimmed_aln_file, tool, cm_version)
+        cache.run_cached(cache_dir, 'predict', key, [cm_file, neff_file],
+                predict_contacts, trimmed_aln_file, cm_file, cm_method=cm_method, worker=worker)
+    elif not os.path.isfile(cm_file) or os.stat(cm_file).st_size == 0:
+        if streamed:
+            predict_streamed(aln_file, trimmed_aln_file, cm_file, cm_method=cm_method)
+        else:
+            predict_contacts(trimmed_aln_file, cm_file, cm_method=cm_method, worker=worker)
     
     # STEP 3
-    ppv = get_ppv(seq_file, cm_file, native_file)
-    numc, numc_norm = get_numc(cm_file, th=th)
-    maxc = get_maxc(cm_file)
-
-    return [ppv, numc, numc_norm, maxc]
+    return get_metrics(seq_file, cm_file, native_file, th=th,
+            cache_dir=cache_dir, metric_names=metric_names, seq=seq, aln_file=aln_file, identity=identity,
+            neff_jobs=neff_jobs)
 
 
 if __name__ == '__main__':
@@ -123,22 +290,42 @@ if __name__ == '__main__':
             (normalized) number of contacts above score threshold, and\
             maximum contact score.')
     p.add_argument('alignment', help='Input aligment file')
-    p.add_argument('-s', '--seqfile', default='', help='Sequence file')
+    p.add_argument('-s', '--seqfile', default='', help='Sequence file (default: first 5 characters of alignment name + .fa, or the query of the alignment if missing)')
     p.add_argument('-n', '--native', default='', help='Reference pdb file to compare with')
-    p.add_argument('-c', '--contact', default='', help='Path to contact predictor executable')
+    p.add_argument('-c', '--contact', default='', help='Path to contact predictor executable or "gdca" for the built-in GaussDCA')
+    p.add_argument('-w', '--worker', default='', help='Command starting a persistent predictor worker, e.g. "julia gdca_worker.jl" (replaces --contact)')
     p.add_argument('-t', '--threshold', default=0., type=float, help='Contact score threshold')
-    p.add_argument('-r', '--reformat', default='', help='Path to reformat.pl script from HHsuite')
+    p.add_argument('-r', '--reformat', default='', help='Path to reformat.pl script from HHsuite (default: built-in converter)')
     p.add_argument('-o', '--output', default='', help='Save output in csv format')
+    p.add_argument('--cachedir', default='', help='Shared cache directory for intermediate files')
+    p.add_argument('--cmversion', default='', help='Version of contact predictor used in cache keys (default: hash of executable)')
+    p.add_argument('-M', '--metrics', default='', help='Comma separated metrics to compute (default: %s)' % ','.join(metrics.DEFAULT_METRICS))
+    p.add_argument('--plugin', default=[], action='append', help='Python file registering additional metrics (can be given multiple times)')
+    p.add_argument('--identity', default=neff.IDENTITY, type=float, help='Sequence identity of similar sequences for the neff metric (default: %g)' % neff.IDENTITY)
+    p.add_argument('--neff-jobs', default=1, type=int, help='Number of threads computing the neff metric (default: 1)')
+    p.add_argument('--stream', action='store_true', help='Pass trimmed alignment to the built-in GaussDCA ("-c gdca") in memory instead of writing the .trimmed file, other predictors still read the file (not with --cachedir or --worker)')
+    p.add_argument('--pipe', action='store_true', help='Pass trimmed alignment to an external contact predictor through a named pipe at the .trimmed path. Only for predictors reading their input exactly once, not run_gdca.sh (not with --cachedir or --worker)')
 
     args = vars(p.parse_args(sys.argv[1:]))
+    for plugin in args['plugin']:
+        metrics.load_plugin(plugin)
+    metric_names = filter(None, args['metrics'].split(','))
+    try:
+        columns = metrics.get_columns(metric_names)
+    except ValueError as e:
+        sys.exit(str(e))
+
     stats = evaluate(args['alignment'], seq_file=args['seqfile'],\
             native_file=args['native'], cm_method=args['contact'],\
-            reformat_method=args['reformat'])
+            reformat_method=args['reformat'], cache_dir=args['cachedir'],\
+            cm_version=args['cmversion'], metric_names=metric_names,\
+            worker=args['worker'], stream=args['stream'], pipe=args['pipe'],\
+            identity=args['identity'], neff_jobs=args['neff_jobs'])
 
     out_file = args['output']
     if out_file:
         with open(out_file, 'w') as outf:
-            outf.write('alignment_file,PPV,numc,maxc\n')
+            outf.write('alignment_file,%s\n' % ','.join(columns))
             outf.write('%s,%s\n' % (args['alignment'], ','.join(map(str, stats))))
     else:
         print '%s,%s' % (args['alignment'], ','.join(map(str, stats)))
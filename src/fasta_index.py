@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+import numpy as np
+
+import a3m_to_trimmed
+
+
+# Sidecar index of a fasta/a3m file in samtools faidx style, one tab
+# separated line per record: name (first word of the name line), number of
+# residues, byte offset of the first residue, residues per line and bytes
+# per line. Records with lines of irregular width get 0 residues per line
+# and the byte length of all their sequence lines.
+INDEX_EXT = '.fai'
+
+
+def get_entries(block, block_offset=0):
+
+    """Index entries of records starting in a block of whole lines.
+    Lines in front of the first name line are skipped.
+    @return (names, np.array of lengths, offsets, line bases, line widths)
+    """
+
+    arr = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == ord('\n'))
+    line_starts = np.r_[0, newlines[:-1] + 1]
+    line_bytes = newlines - line_starts + 1
+    has_cr = (line_bytes > 1) & (arr[newlines - 1] == ord('\r'))
+    line_bases = line_bytes - 1 - has_cr
+
+    name_lines = np.flatnonzero(arr[line_starts] == ord('>'))
+    first_lines = name_lines + 1
+    end_lines = np.r_[name_lines[1:], len(line_starts)]
+    num_lines = end_lines - first_lines
+
+    bases_sum = np.r_[0, np.cumsum(line_bases)]
+    lengths = bases_sum[end_lines] - bases_sum[first_lines]
+    offsets = block_offset + newlines[name_lines] + 1
+    spans = np.r_[line_starts, len(arr)][end_lines] - (newlines[name_lines] + 1)
+    first = np.minimum(first_lines, len(line_starts) - 1)
+    linebases = np.where(num_lines > 0, line_bases[first], 0)
+    linewidths = np.where(num_lines > 0, line_bytes[first], 0)
+
+    # all lines of a record but the last have the width of the first one
+    seq_lines = np.flatnonzero(arr[line_starts] != ord('>'))
+    seq_lines = seq_lines[seq_lines > (name_lines[0] if len(name_lines) else len(line_starts))]
+    record = np.searchsorted(name_lines, seq_lines, side='right') - 1
+    is_last = seq_lines == end_lines[record] - 1
+    irregular = np.where(is_last, line_bases[seq_lines] > linebases[record],
+            (line_bases[seq_lines] != linebases[record]) | (line_bytes[seq_lines] != linewidths[record]))
+    irregular = np.unique(record[irregular])
+    linebases[irregular] = 0
+    linewidths[irregular] = spans[irregular]
+
+    names = []
+    for start, end in zip(line_starts[name_lines].tolist(), newlines[name_lines].tolist()):
+        name = block[start + 1:end].split(None, 1)
+        names.append(name[0] if name else '')
+    return (names, lengths, offsets, linebases, linewidths)
+
+
+def build(aln_filename, index_filename=''):
+
+    """Index records of a (not compressed) fasta/a3m file in one pass.
+    @param  index_filename  output index (default: aln_filename + INDEX_EXT),
+                            nothing is written if the file cannot be created
+    @return FastaIndex
+    """
+
+    with open(aln_filename, 'rb') as aln:
+        if aln.read(2) == '\x1f\x8b':
+            raise ValueError('Cannot index compressed file %s' % aln_filename)
+        aln.seek(0)
+        entries = []
+        offset = 0
+        for block in a3m_to_trimmed.get_blocks(a3m_to_trimmed.read_chunks(aln)):
+            if not block.endswith('\n'):
+                block += '\n'
+            entries.append(get_entries(block, offset))
+            offset += len(block)
+
+    if not entries:
+        raise ValueError('%s is empty' % aln_filename)
+    names = [name for e in entries for name in e[0]]
+    index = FastaIndex(aln_filename, names,
+            *[np.concatenate([e[i] for e in entries]) for i in range(1, 5)])
+    if not index_filename:
+        index_filename = aln_filename + INDEX_EXT
+    try:
+        index.write(index_filename)
+    except (IOError, OSError):
+        pass
+    return index
+
+
+def load(aln_filename):
+
+    """Index of fasta/a3m file, built if it is missing or older than the file."""
+
+    index_filename = aln_filename + INDEX_EXT
+    if os.path.isfile(index_filename) and \
+            os.path.getmtime(index_filename) >= os.path.getmtime(aln_filename):
+        return FastaIndex.read(aln_filename, index_filename)
+    return build(aln_filename, index_filename)
+
+
+class FastaIndex(object):
+
+    """Random access to the records of a fasta/a3m file."""
+
+    def __init__(self, aln_filename, names, lengths, offsets, linebases, linewidths):
+        self.aln_filename = aln_filename
+        self.names = names
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.linebases = np.asarray(linebases, dtype=np.int64)
+        self.linewidths = np.asarray(linewidths, dtype=np.int64)
+        self.name_dict = None
+
+    @classmethod
+    def read(cls, aln_filename, index_filename):
+        with open(index_filename, 'r') as ifile:
+            lines = ifile.read().splitlines()
+        names = [line.partition('\t')[0] for line in lines]
+        values = ' '.join([line.partition('\t')[2] for line in lines])
+        values = np.fromstring(values, dtype=np.int64, sep=' ').reshape(-1, 4)
+        return cls(aln_filename, names, *values.T)
+
+    def write(self, index_filename):
+        with open(index_filename, 'w') as outf:
+            for k, name in enumerate(self.names):
+                outf.write('%s\t%d\t%d\t%d\t%d\n' % (name, self.lengths[k],
+                    self.offsets[k], self.linebases[k], self.linewidths[k]))
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_span(self, n):
+
+        """Number of bytes from the first residue to the end of record n."""
+
+        length, linebases, linewidth = self.lengths[n], self.linebases[n], self.linewidths[n]
+        if linebases == 0:
+            return linewidth
+        return length + (length - 1) // linebases * (linewidth - linebases)
+
+    def fetch(self, n):
+
+        """Sequence of the n-th record (0 = query), newlines removed."""
+
+        if not -len(self) <= n < len(self):
+            raise IndexError('%s has %d records' % (self.aln_filename, len(self)))
+        with open(self.aln_filename, 'rb') as aln:
+            aln.seek(self.offsets[n])
+            data = aln.read(self.get_span(n))
+        return data.replace('\n', '').replace('\r', '')
+
+    def get_query(self):
+        return self.fetch(0)
+
+    def find(self, name):
+
+        """Number of the first record with given name, -1 if there is none."""
+
+        if self.name_dict is None:
+            self.name_dict = {}
+            for k, record_name in enumerate(self.names):
+                self.name_dict.setdefault(record_name, k)
+        return self.name_dict.get(name, -1)
+
+    def get(self, name):
+        n = self.find(name)
+        if n < 0:
+            raise KeyError('No record %s in %s' % (name, self.aln_filename))
+        return self.fetch(n)
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Build offset index of fasta/a3m\
+            file (FILE.fai) and print records from it.')
+    p.add_argument('alignment', help='Fasta or a3m file (not compressed)')
+    p.add_argument('-n', '--number', default=[], type=int, action='append', help='Print n-th record, 0 = query (can be given multiple times)')
+    p.add_argument('-g', '--name', default=[], action='append', help='Print record with given name (can be given multiple times)')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    try:
+        index = load(args['alignment'])
+        for n in args['number']:
+            print '>%s\n%s' % (index.names[n], index.fetch(n))
+        for name in args['name']:
+            print '>%s\n%s' % (name, index.get(name))
+    except (IOError, ValueError, IndexError, KeyError) as e:
+        sys.exit('ERROR: %s' % e)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+import numpy as np
+
+import parse_msa
+import neff
+
+try:
+    from scipy.linalg import lapack
+except ImportError:
+    lapack = None
+
+
+# GaussDCA (Baldassi et al., PLoS ONE 2014) on numpy, all heavy steps are
+# matrix products and a matrix inversion, so they run on (multi-threaded) BLAS;
+# sequence reweighting is done by neff.py
+
+# residue alphabet, all other characters count as gap (last state)
+ALPHABET = parse_msa.ALPHABET
+Q = len(ALPHABET)
+
+# sequences per block of matrix products, bounds temporary memory
+BLOCKSIZE = 1024
+
+
+def read_alignment(afile, max_gap_fraction=0.9):
+
+    """Read aligned sequences (trimmed/fasta format) into state numbers.
+    @param  afile               alignment file, all sequences of equal length
+    @param  max_gap_fraction    sequences with more gaps are skipped (default=0.9)
+    @return np.array((num_seqs, length), uint8), see "encode"
+    """
+
+    records = afile.read().split('>')[1:]
+    afile.close()
+    seqs = [r.partition('\n')[2].replace('\n', '').replace('\r', '') for r in records]
+    return encode(seqs, max_gap_fraction)
+
+
+def encode(seqs, max_gap_fraction=0.9):
+
+    """State numbers of aligned sequences.
+    @param  seqs                [sequence], all of equal length
+    @param  max_gap_fraction    sequences with more gaps are skipped (default=0.9)
+    @return np.array((num_seqs, length), uint8), see "to_states"
+    """
+
+    seqs = list(seqs)
+    if not seqs:
+        raise ValueError('Alignment contains no sequences')
+    length = len(seqs[0])
+    if any(len(s) != length for s in seqs):
+        raise ValueError('Sequences of alignment differ in length')
+
+    chars = np.frombuffer(''.join(seqs), dtype=np.uint8).reshape(len(seqs), length)
+    return to_states(chars, max_gap_fraction)
+
+
+def to_states(chars, max_gap_fraction=0.9):
+
+    """State numbers of an alignment given as array of characters.
+    @param  chars   np.array((num_seqs, length), uint8)
+    @return np.array((num_seqs, length), uint8), see "from_codes"
+    """
+
+    return from_codes(parse_msa.encode(chars), max_gap_fraction)
+
+
+def from_codes(codes, max_gap_fraction=0.9):
+
+    """State numbers of an alignment encoded by parse_msa.
+    @param  codes   np.array((num_seqs, length), uint8)
+    @return np.array((num_seqs, length), uint8), states 0..Q-1, Q-1 for gaps
+    """
+
+    # unknown residues count as gap
+    msa = np.minimum(codes, Q - 1)
+    return msa[(msa == Q - 1).mean(axis=1) <= max_gap_fraction]
+
+
+def read(aln_filename, max_gap_fraction=0.9):
+
+    """Read trimmed alignment or binary alignment file (see parse_msa)."""
+
+    if parse_msa.is_msa(aln_filename):
+        return from_codes(parse_msa.load(aln_filename)[0], max_gap_fraction)
+    return read_alignment(open(aln_filename, 'r'), max_gap_fraction)
+
+
+def remove_duplicates(msa):
+    rows = np.ascontiguousarray(msa).view(np.dtype((np.void, msa.shape[1])))
+    return msa[np.sort(np.unique(rows, return_index=True)[1])]
+
+
+def get_theta(msa):
+
+    """Automatic reweighting threshold from the mean fraction of identical positions."""
+
+    num_seqs, length = msa.shape
+    if num_seqs < 2:
+        return 0.5
+    # identical pairs per column from the state counts, each sequence with
+    # itself included
+    counts = np.bincount((np.arange(length) * Q + msa).ravel(), minlength=length * Q)
+    num_ident = (np.dot(counts, counts) - num_seqs * length) / 2.
+    mean_frac_id = num_ident / (0.5 * num_seqs * (num_seqs - 1) * length)
+    return min(0.5, 0.38 * 0.32 / mean_frac_id)
+
+
+def get_weights(msa, theta):
+
+    """Sequence weights, 1 / number of sequences closer than theta * length.
+    @return (weights np.array(num_seqs), effective number of sequences)
+    """
+
+    length = msa.shape[1]
+    # distance length - identities below threshold, the sequence itself
+    # is always counted
+    thresh = int(np.floor(theta * length))
+    return neff.get_weights(msa, length - thresh + 1)
+
+
+def get_frequencies(msa, weights, pseudocount=0.8):
+
+    """Reweighted single and pair frequencies with pseudocount, gap state left out.
+    @return (Pi np.array(length * (Q-1)), Pij np.array((length * (Q-1), length * (Q-1))))
+    """
+
+    s = Q - 1
+    size = msa.shape[1] * s
+    meff = weights.sum()
+    pi = np.zeros(size)
+    pij = np.zeros((size, size))
+    for start in range(0, len(msa), BLOCKSIZE):
+        x = neff.one_hot(msa[start:start + BLOCKSIZE], s)
+        w = weights[start:start + BLOCKSIZE]
+        pi += np.dot(w, x)
+        pij += np.dot(x.T * w, x)
+    pi /= meff
+    pij /= meff
+
+    pcq = pseudocount / Q
+    pi = (1 - pseudocount) * pi + pcq
+    pij = (1 - pseudocount) * pij + pcq / Q
+    # diagonal blocks only hold single site frequencies
+    for i in range(0, size, s):
+        pij[i:i + s, i:i + s] = np.diag(pi[i:i + s])
+    return (pi, pij)
+
+
+def invert(cov):
+
+    """Inverse of the covariance matrix, by Cholesky decomposition if scipy
+    is available.
+    """
+
+    if lapack is None:
+        return np.linalg.inv(cov)
+    chol, info = lapack.dpotrf(cov)
+    if info == 0:
+        inv_cov, info = lapack.dpotri(chol)
+    if info != 0:
+        return np.linalg.inv(cov)
+    # only the upper triangle is computed
+    lower = np.tril_indices(len(cov), -1)
+    inv_cov[lower] = inv_cov.T[lower]
+    return inv_cov
+
+
+def get_fn_scores(inv_cov, length):
+
+    """Frobenius norms of the zero-sum gauged coupling blocks, APC corrected.
+    Each (Q-1) x (Q-1) block is extended by zeros for the gap state.
+    @return np.array((length, length))
+    """
+
+    s = Q - 1
+    fn = np.zeros((length, length))
+    for i in range(length):
+        block = inv_cov[i * s:(i + 1) * s].reshape(s, length, s)
+        row_sums = block.sum(axis=2)
+        col_sums = block.sum(axis=0)
+        fn2 = (block * block).sum(axis=(0, 2))
+        fn2 -= (row_sums * row_sums).sum(axis=0) / Q
+        fn2 -= (col_sums * col_sums).sum(axis=1) / Q
+        fn2 += row_sums.sum(axis=0) ** 2 / Q ** 2
+        fn[i] = np.sqrt(np.maximum(fn2, 0))
+    fn[np.diag_indices(length)] = 0
+
+    # average product correction
+    fn_sums = fn.sum(axis=0)
+    fn_total = fn_sums.sum() * (1 - 1. / length)
+    return fn - np.outer(fn_sums, fn_sums) / fn_total
+
+
+def get_ranking(scores, min_separation=5):
+
+    """Residue pairs i < j with j - i >= min_separation by descending score.
+    @return [(i, j, score)], 1-based residue numbers
+    """
+
+    i, j = np.triu_indices(len(scores), min_separation)
+    pair_scores = scores[i, j]
+    order = np.argsort(-pair_scores, kind='mergesort')
+    return zip((i[order] + 1).tolist(), (j[order] + 1).tolist(), pair_scores[order].tolist())
+
+
+def gdca(msa, pseudocount=0.8, theta=-1., min_separation=5):
+
+    """Predict contacts with GaussDCA.
+    @param  msa                 encoded alignment as obtained from "read_alignment"
+    @param  pseudocount         weight of the uniform pseudocount (default=0.8)
+    @param  theta               reweighting threshold as fraction of the
+                                alignment length (default: automatic)
+    @param  min_separation      minimal sequence separation of ranked pairs (default=5)
+    @return ([(i, j, score)] by descending score,
+             {'M': number of sequences, 'N': length, 'theta': theta, 'Meff': effective number of sequences})
+    """
+
+    msa = remove_duplicates(msa)
+    num_seqs, length = msa.shape
+    if theta < 0:
+        theta = get_theta(msa)
+    weights, meff = get_weights(msa, theta)
+
+    pi, pij = get_frequencies(msa, weights, pseudocount)
+    inv_cov = invert(pij - np.outer(pi, pi))
+
+    ranking = get_ranking(get_fn_scores(inv_cov, length), min_separation)
+    return (ranking, {'M': num_seqs, 'N': length, 'theta': theta, 'Meff': meff})
+
+
+def write(ranking, outfile):
+    for i, j, score in ranking:
+        outfile.write('%d %d %e\n' % (i, j, score))
+
+
+def predict(trimmed_aln_file, cm_file, neff_file='', msa=None):
+
+    """Run GaussDCA like run_gdca.sh: write contact map and number of effective sequences.
+    @param  msa     encoded alignment (see "encode"), if given the trimmed
+                    alignment file is not read, only used to name the neff file
+    """
+
+    if msa is None:
+        msa = read(trimmed_aln_file)
+    ranking, stats = gdca(msa)
+    with open(cm_file, 'w') as outf:
+        write(ranking, outf)
+    if not neff_file:
+        neff_file = '.'.join(trimmed_aln_file.split('.')[:-1]) + '.gneff'
+    with open(neff_file, 'w') as outf:
+        outf.write('theta = %g\n' % stats['theta'])
+        outf.write('M = %d N = %d Meff = %g\n' % (stats['M'], stats['N'], stats['Meff']))
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Predict contacts with GaussDCA.')
+    p.add_argument('alignment', help='Alignment in trimmed/fasta format or binary alignment file (see parse_msa.py)')
+    p.add_argument('outfile', help='Output contact file')
+    p.add_argument('-p', '--pseudocount', default=0.8, type=float, help='Pseudocount weight (default: 0.8)')
+    p.add_argument('--theta', default=-1., type=float, help='Reweighting threshold (default: automatic)')
+    p.add_argument('--maxgap', default=0.9, type=float, help='Maximal gap fraction of sequences (default: 0.9)')
+    p.add_argument('--minsep', default=5, type=int, help='Minimal sequence separation of contacts (default: 5)')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    msa = read(args['alignment'], args['maxgap'])
+    ranking, stats = gdca(msa, args['pseudocount'], args['theta'], args['minsep'])
+    with open(args['outfile'], 'w') as outf:
+        write(ranking, outf)
+    print 'M = %d N = %d Meff = %g' % (stats['M'], stats['N'], stats['Meff'])
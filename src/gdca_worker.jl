@@ -0,0 +1,34 @@
+# Persistent GaussDCA worker, loads GaussDCA once and then answers
+# prediction jobs on stdin/stdout, see predictor_worker.py for the protocol.
+# usage: julia gdca_worker.jl
+using GaussDCA
+
+function predict(trimmed_file, cm_file, neff_file)
+    # GaussDCA reports the number of effective sequences on stdout
+    open(neff_file, "w") do f
+        redirect_stdout(f) do
+            FNR = gDCA(trimmed_file)
+            printrank(cm_file, FNR)
+        end
+    end
+end
+
+while !eof(stdin)
+    fields = split(chomp(readline(stdin)), '\t')
+    if fields[1] == "QUIT"
+        break
+    elseif fields[1] == "PING"
+        reply = "PONG"
+    elseif fields[1] == "PREDICT" && length(fields) == 4
+        try
+            predict(fields[2], fields[3], fields[4])
+            reply = "OK"
+        catch e
+            reply = "ERROR\t" * join(split(sprint(showerror, e)), " ")
+        end
+    else
+        reply = "ERROR\tUnknown request " * fields[1]
+    end
+    println(stdout, reply)
+    flush(stdout)
+end
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+import os
+import imp
+import collections
+
+import parse_contacts
+import parse_fasta
+import parse_msa
+import msa_stats
+import neff
+import ppv
+
+
+# registered metrics in column order: {name: (csv columns, function)}
+METRICS = collections.OrderedDict()
+DEFAULT_METRICS = ['PPV', 'numc', 'maxc', 'top_ppv']
+
+
+def register(name, columns, func):
+
+    """Make a metric available to evaluate.
+    @param  name    name used to select the metric
+    @param  columns csv column names of the values returned by func
+    @param  func    function(data) -> [one value per column],
+                    data as obtained from "load"
+    """
+
+    METRICS[name] = (list(columns), func)
+
+
+def load_plugin(filename):
+
+    """Import python file that registers additional metrics."""
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return imp.load_source('metrics_%s' % name, filename)
+
+
+def get_names(names=[]):
+
+    """Selected metric names, DEFAULT_METRICS if none are given."""
+
+    names = list(names) or DEFAULT_METRICS
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError('Unknown metric(s) %s, use one of %s' %
+                (', '.join(unknown), ', '.join(METRICS)))
+    return names
+
+
+def get_columns(names=[]):
+    return sum([METRICS[name][0] for name in get_names(names)], [])
+
+
+def load(seq_file, cm_file, native_file='', th=0., cache_dir='', seq='', aln_file='', identity=neff.IDENTITY, neff_jobs=1):
+
+    """Parse sequence and contact map once for all metrics.
+    The native structure is only read when a metric asks for it with
+    "get_reference".
+    @param  th          contact score threshold
+    @param  cache_dir   native structure cache directory
+    @param  seq         query sequence, read from seq_file if not given
+    @param  aln_file    alignment, only read when a metric asks for it with
+                        "get_codes"
+    @param  identity    sequence identity of similar sequences for Neff
+    @param  neff_jobs   number of threads computing Neff
+    @return {'seq': str, 'contacts': np.array as obtained from parse_contacts.load,
+             'cmap': parse_contacts.ContactMap, 'native_file': str, 'th': float,
+             'cache_dir': str, 'aln_file': str, 'identity': float,
+             'neff_jobs': int}
+    """
+
+    if not seq:
+        seq = parse_fasta.read_fasta(open(seq_file, 'r')).values()[0][0]
+    contacts = parse_contacts.load(open(cm_file, 'r'))
+    return {'seq': seq, 'contacts': contacts,
+            'cmap': parse_contacts.ContactMap(contacts),
+            'native_file': native_file, 'th': th, 'cache_dir': cache_dir,
+            'aln_file': aln_file, 'identity': identity, 'neff_jobs': neff_jobs}
+
+
+def get_reference(data):
+
+    """Native contact map and alignment mask, see ppv.get_ref_contact_map."""
+
+    if 'ref_contact_map' not in data:
+        data['ref_contact_map'], data['ali_mask'] = ppv.get_ref_contact_map(
+                data['seq'], data['native_file'], cache_dir=data['cache_dir'])
+    return (data['ref_contact_map'], data['ali_mask'])
+
+
+def get_codes(data):
+
+    """Encoded alignment, see parse_msa.read_codes."""
+
+    if 'codes' not in data:
+        if not data['aln_file']:
+            raise ValueError('No alignment given for alignment metrics')
+        data['codes'] = parse_msa.read_codes(data['aln_file'])
+    return data['codes']
+
+
+def get_ali_stats(data):
+
+    """Column statistics of the alignment, see msa_stats.get_stats."""
+
+    if 'ali_stats' not in data:
+        data['ali_stats'] = msa_stats.get_stats(get_codes(data))
+    return data['ali_stats']
+
+
+def run(data, names=[]):
+
+    """Compute selected metrics.
+    @param  data    scoring data as obtained from "load"
+    @param  names   metric names (default: DEFAULT_METRICS)
+    @return [values], one per column of "get_columns"
+    """
+
+    values = []
+    for name in get_names(names):
+        columns, func = METRICS[name]
+        result = list(func(data))
+        if len(result) != len(columns):
+            raise ValueError('Metric %s returned %d values for %d columns' %
+                    (name, len(result), len(columns)))
+        values += result
+    return values
+
+
+def get_top_ppvs(data):
+
+    """PPV of the top L/10, L/5, L/2, L and 2L ranked contacts."""
+
+    if 'top_ppvs' not in data:
+        factors = [top[1] for top in ppv.TOP_FACTORS]
+        if len(data['contacts']) == 0:
+            data['top_ppvs'] = [0.0] * len(factors)
+            return data['top_ppvs']
+        ref_contact_map, ali_mask = get_reference(data)
+        data['top_ppvs'] = ppv.get_ranked_ppvs(data['contacts'],
+                len(data['seq']), ref_contact_map, ali_mask, factors)
+    return data['top_ppvs']
+
+
+def get_ppv(data):
+
+    """PPV of the top L ranked contacts."""
+
+    factors = [top[1] for top in ppv.TOP_FACTORS]
+    return [get_top_ppvs(data)[factors.index(1.0)]]
+
+
+def get_numc(data):
+
+    """(Normalized) number of contacts above score threshold.
+    REMARK: in case of GaussDCA the score is a log-likelihood,
+    => score above 0.0 = more likely to be correct than false
+    Threshold needs to be changed depending on contact predictor.
+    """
+
+    cmap = data['cmap']
+    numc = cmap.count(data['th'])
+    return [numc, numc / float(pow(cmap.n, 2))]
+
+
+def get_maxc(data):
+
+    """Maximal contact score."""
+
+    return [data['cmap'].max()]
+
+
+def get_ali_summary(data):
+
+    """Number of sequences, mean gap fraction and mean entropy (bits) of
+    the alignment columns.
+    """
+
+    return msa_stats.get_summary(get_ali_stats(data))
+
+
+def get_neff(data):
+
+    """Effective number of sequences at the sequence identity data['identity'],
+    also per residue of the query.
+    """
+
+    codes = get_codes(data)
+    num_eff = neff.get_neff(codes, data['identity'], data['neff_jobs'])[0]
+    return [num_eff, num_eff / codes.shape[1]]
+
+
+register('PPV', ['PPV'], get_ppv)
+register('numc', ['numc', 'numc_norm'], get_numc)
+register('maxc', ['maxc'], get_maxc)
+register('top_ppv', ['PPV_%s' % top[0] for top in ppv.TOP_FACTORS], get_top_ppvs)
+register('ali', ['num_seqs', 'gap_fraction', 'entropy'], get_ali_summary)
+register('neff', ['neff', 'neff_L'], get_neff)
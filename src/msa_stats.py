@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+import numpy as np
+
+import parse_msa
+
+
+# column statistics of an encoded alignment (see parse_msa), computed over
+# blocks of rows so that memory mapped alignments are never copied whole
+NUM_CODES = parse_msa.UNKNOWN + 1
+NUM_AA = parse_msa.GAP
+BLOCKSIZE = 1 << 24
+
+STATS = ['coverage', 'gap_fraction', 'entropy']
+
+
+def get_counts(codes, blocksize=BLOCKSIZE):
+
+    """Number of each code per column.
+    @param  codes   np.array((num_seqs, length), uint8)
+    @return np.array((length, NUM_CODES), int64)
+    """
+
+    num_seqs, length = codes.shape
+    counts = np.zeros(length * NUM_CODES, dtype=np.int64)
+    col_offsets = np.arange(length, dtype=np.int64) * NUM_CODES
+    rows = max(blocksize // max(length, 1), 1)
+    for start in range(0, num_seqs, rows):
+        block = col_offsets + codes[start:start + rows]
+        counts += np.bincount(block.ravel(), minlength=length * NUM_CODES)
+    return counts.reshape(length, NUM_CODES)
+
+
+def get_stats(codes, blocksize=BLOCKSIZE):
+
+    """Per column statistics.
+    @return {'num_seqs': int,
+             'coverage': np.array(length) number of sequences without gap,
+             'gap_fraction': np.array(length),
+             'frequencies': np.array((length, 20)) amino acid frequencies
+                            among the residues of the column (ALPHABET order),
+             'entropy': np.array(length) Shannon entropy of the amino acid
+                        frequencies in bits}
+    """
+
+    num_seqs = len(codes)
+    counts = get_counts(codes, blocksize)
+    gaps = counts[:, parse_msa.GAP]
+    aa_counts = counts[:, :NUM_AA].astype(np.float64)
+    num_aa = aa_counts.sum(axis=1)
+    freqs = aa_counts / np.maximum(num_aa, 1)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plogp = np.where(freqs > 0, freqs * np.log2(freqs), 0.)
+    return {'num_seqs': num_seqs,
+            'coverage': num_seqs - gaps,
+            'gap_fraction': gaps / float(max(num_seqs, 1)),
+            'frequencies': freqs,
+            'entropy': -plogp.sum(axis=1)}
+
+
+def get_summary(stats):
+
+    """Alignment summary: number of sequences, mean gap fraction and mean
+    entropy over columns.
+    """
+
+    return [stats['num_seqs'], float(stats['gap_fraction'].mean()),
+            float(stats['entropy'].mean())]
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Print per column coverage, gap\
+            fraction and entropy of an alignment.')
+    p.add_argument('alignment', help='a3m, trimmed or binary alignment file (see parse_msa.py)')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    try:
+        stats = get_stats(parse_msa.read_codes(args['alignment']))
+    except (IOError, ValueError) as e:
+        sys.exit('ERROR: %s' % e)
+    print 'column,%s' % ','.join(STATS)
+    for i in range(len(stats['coverage'])):
+        print '%d,%s' % (i + 1, ','.join([str(stats[name][i]) for name in STATS]))
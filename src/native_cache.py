@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import argparse
+import numpy as np
+
+import cache
+import distances
+import parse_pdb
+
+
+# bump when the stored arrays change meaning
+VERSION = '1'
+ATOM_DEFS = ['CB', 'CA', 'heavy']
+
+# in-process cache of the most recently used structures, a worker of a
+# batch run only keeps a few dense distance matrices:
+# {(path, mtime, size, chain, atom): native}
+MAX_NATIVES = 8
+NATIVES = cache.LRU(MAX_NATIVES)
+
+
+def parse_native(pdb_filename, chain='', atom='CB'):
+
+    """Extract atom sequence, coordinates and distance matrix from pdb file.
+    @param  atom    'CB' (CA for residues without CB), 'CA' or 'heavy'
+                    (minimal atom-atom distance, capped at 12 Angstroem)
+    @return {'atom_seq': str, 'coords': np.array((n, 3)), 'dist_mat': np.array((n, n))}
+            for 'heavy', coords holds all atoms and 'res_idx' their residue
+    """
+
+    atoms = parse_pdb.read_atoms(open(pdb_filename, 'r'))
+    native = {}
+    if atom == 'CB':
+        coord_lst = parse_pdb.get_cb_coordinates(atoms, chain)
+    elif atom == 'CA':
+        coord_lst = parse_pdb.get_ca_coordinates(atoms, chain)
+    elif atom == 'heavy':
+        coord_lst, native['res_idx'], num_res = parse_pdb.get_residue_atoms(atoms, chain)
+    else:
+        raise ValueError('Unknown atom definition "%s", use one of %s' % (atom, ', '.join(ATOM_DEFS)))
+    native['coords'] = np.array(coord_lst, dtype=float).reshape(-1, 3)
+    native['atom_seq'] = parse_pdb.get_atom_seq(atoms, chain)
+    if atom == 'heavy':
+        native['dist_mat'] = distances.get_heavy_contacts(native['coords'],
+                native['res_idx'], n=num_res)[1]
+    else:
+        native['dist_mat'] = distances.get_cb_contacts(native['coords'])
+    return native
+
+
+def get_key(pdb_filename, chain='', atom='CB'):
+    return cache.get_key('native', VERSION, cache.file_hash(pdb_filename), chain, atom)
+
+
+def load(path):
+    native = {}
+    for fname in os.listdir(path):
+        if fname.endswith('.npy'):
+            native[fname[:-4]] = np.load(os.path.join(path, fname), mmap_mode='r')
+    with open(os.path.join(path, 'atom_seq.txt')) as f:
+        native['atom_seq'] = f.read().strip()
+    return native
+
+
+def save(native, cache_dir, key):
+    tmp_path = cache.make_tmp(cache_dir, 'native', key)
+    for name in native:
+        if name != 'atom_seq':
+            np.save(os.path.join(tmp_path, '%s.npy' % name), native[name])
+    with open(os.path.join(tmp_path, 'atom_seq.txt'), 'w') as f:
+        f.write(native['atom_seq'] + '\n')
+    cache.commit(tmp_path, cache.get_path(cache_dir, 'native', key))
+
+
+def get_native(pdb_filename, chain='', atom='CB', cache_dir=''):
+
+    """Reference structure data, parsed once per file, chain and atom definition.
+    The MAX_NATIVES most recently used results are kept in memory and, if
+    cache_dir is given, stored on disk keyed by the pdb file content.
+    Arrays loaded from disk are read-only memory maps.
+    @param  pdb_filename    native pdb file
+    @param  chain           chain identifier (default: first chain)
+    @param  atom            atom definition, one of ATOM_DEFS
+    @param  cache_dir       persistent cache root directory (default: none)
+    @return {'atom_seq': str, 'coords': np.array((n, 3)), 'dist_mat': np.array((n, n))}
+    """
+
+    st = os.stat(pdb_filename)
+    mem_key = (os.path.realpath(pdb_filename), st.st_mtime, st.st_size, chain, atom)
+    if mem_key in NATIVES:
+        return NATIVES[mem_key]
+
+    if cache_dir:
+        key = get_key(pdb_filename, chain, atom)
+        path = cache.get_path(cache_dir, 'native', key)
+        if not os.path.isdir(path):
+            save(parse_native(pdb_filename, chain, atom), cache_dir, key)
+        native = load(path)
+    else:
+        native = parse_native(pdb_filename, chain, atom)
+
+    NATIVES[mem_key] = native
+    return native
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Pre-compute reference contact\
+            map data of native structures into cache directory.')
+    p.add_argument('pdb', nargs='+', help='Reference pdb files')
+    p.add_argument('-d', '--cachedir', required=True, help='Cache directory')
+    p.add_argument('--chain', default='', help='Chain identifier (default: first chain)')
+    p.add_argument('--atom', default=[], action='append', choices=ATOM_DEFS, help='Atom definition, can be given multiple times (default: CB)')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    atom_defs = sorted(set(args['atom'])) or ['CB']
+
+    num_failed = 0
+    for pdb_filename in args['pdb']:
+        for atom in atom_defs:
+            try:
+                get_native(pdb_filename, args['chain'], atom, args['cachedir'])
+            except Exception as e:
+                num_failed += 1
+                sys.stderr.write('ERROR: %s: %s\n' % (pdb_filename, e))
+    if num_failed:
+        sys.exit(1)
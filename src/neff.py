@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+import parse_msa
+
+
+# Effective number of sequences: every sequence is weighted by 1 / number of
+# sequences (itself included) sharing at least a given fraction of identical
+# positions, gaps count as a state. Identities of all pairs are matrix
+# products of one-hot encoded blocks of sequences (float32 is exact for
+# counts below 2^24), only blocks on and above the diagonal are computed.
+# np.dot releases the GIL, so blocks can also be run on several threads.
+
+# states: residues of parse_msa.ALPHABET, unknown residues count as gap
+Q = parse_msa.GAP + 1
+IDENTITY = 0.8
+
+# sequences per block, a block product takes BLOCKSIZE^2 * 4 bytes
+BLOCKSIZE = 1024
+
+
+def get_states(codes):
+
+    """States 0..Q-1 of an alignment encoded by parse_msa, Q-1 for gaps."""
+
+    return np.minimum(codes, Q - 1)
+
+
+def one_hot(msa, q=Q, dtype=np.float64):
+
+    """Binary encoding of the states of each column.
+    @param  q   number of states kept, states >= q are all zero (e.g. q=Q-1 drops gaps)
+    @return np.array((num_seqs, length * q), dtype)
+    """
+
+    num_seqs, length = msa.shape
+    x = np.zeros((num_seqs, length, q), dtype=dtype)
+    seq_idx, col_idx = np.nonzero(msa < q)
+    x[seq_idx, col_idx, msa[seq_idx, col_idx]] = 1
+    return x.reshape(num_seqs, length * q)
+
+
+def count_close(msa, min_ident, jobs=1):
+
+    """Number of sequences with at least min_ident identical positions,
+    for every sequence (itself included).
+    @param  msa         np.array((num_seqs, length), uint8) states, see "get_states"
+    @param  jobs        number of threads running blocks of rows
+    @return np.array(num_seqs, int64)
+    """
+
+    num_seqs = len(msa)
+
+    def count_rows(start):
+        counts = np.zeros(num_seqs, dtype=np.int64)
+        x = one_hot(msa[start:start + BLOCKSIZE], dtype=np.float32)
+        end = start + len(x)
+        for other in range(start, num_seqs, BLOCKSIZE):
+            y = x if other == start else one_hot(msa[other:other + BLOCKSIZE], dtype=np.float32)
+            close = np.dot(x, y.T) >= min_ident
+            counts[start:end] += close.sum(axis=1)
+            if other != start:
+                counts[other:other + len(y)] += close.sum(axis=0)
+        return counts
+
+    starts = range(0, num_seqs, BLOCKSIZE)
+    num_close = np.zeros(num_seqs, dtype=np.int64)
+    if jobs > 1 and len(starts) > 1:
+        pool = ThreadPool(jobs)
+        try:
+            for counts in pool.imap_unordered(count_rows, starts):
+                num_close += counts
+        finally:
+            pool.close()
+    else:
+        for start in starts:
+            num_close += count_rows(start)
+    return num_close
+
+
+def get_weights(msa, min_ident, jobs=1):
+
+    """Sequence weights, 1 / number of sequences with at least min_ident
+    identical positions.
+    @return (weights np.array(num_seqs), effective number of sequences)
+    """
+
+    weights = 1. / np.maximum(count_close(msa, min_ident, jobs), 1)
+    return (weights, weights.sum())
+
+
+def get_min_identities(length, identity=IDENTITY):
+
+    """Number of identical positions of a fraction identity of length."""
+
+    # round first, e.g. 0.8 * 10 is 8.000000000000002
+    return int(np.ceil(round(identity * length, 6)))
+
+
+def get_neff(codes, identity=IDENTITY, jobs=1):
+
+    """Effective number of sequences of an alignment encoded by parse_msa.
+    @param  identity    fraction of identical positions of similar sequences
+    @return (effective number of sequences, weights np.array(num_seqs))
+    """
+
+    msa = get_states(codes)
+    weights, neff = get_weights(msa, get_min_identities(msa.shape[1], identity), jobs)
+    return (neff, weights)
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Compute the effective number of\
+            sequences of an alignment.')
+    p.add_argument('alignment', help='a3m, trimmed or binary alignment file (see parse_msa.py)')
+    p.add_argument('-i', '--identity', default=IDENTITY, type=float, help='Sequence identity of similar sequences (default: %g)' % IDENTITY)
+    p.add_argument('-j', '--jobs', default=1, type=int, help='Number of threads (default: 1, BLAS may use more)')
+    p.add_argument('-w', '--weights', default='', help='Write sequence weights to this file, one per line')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    try:
+        codes = parse_msa.read_codes(args['alignment'])
+    except (IOError, ValueError) as e:
+        sys.exit('ERROR: %s' % e)
+    neff, weights = get_neff(codes, args['identity'], args['jobs'])
+    if args['weights']:
+        np.savetxt(args['weights'], weights, fmt='%g')
+    print 'M = %d N = %d Neff = %g' % (codes.shape[0], codes.shape[1], neff)
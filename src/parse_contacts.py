@@ -1,8 +1,166 @@
 #!/usr/bin/env python
 import sys
+import re
 import numpy as np
 
 
+# contacts as returned by "load"
+CONTACT_DTYPE = [('i', np.int64), ('j', np.int64), ('score', np.float64)]
+
+# header/footer lines (PhyCMAP, CASP RR) and empty lines do not start with
+# a residue number
+NON_DATA = re.compile(r'^(?![ \t]*\d).*\n?', re.M)
+
+# bytes read at once from presorted contact files
+CHUNKSIZE = 1 << 16
+
+
+def get_sep(line):
+
+    """Guess separator of a contact line.
+    @param  line    line of contact file
+    @return ',', ' ' or '\t'
+    """
+
+    if len(line.split(',')) != 1:
+        return ','
+    elif len(line.split(' ')) != 1:
+        return ' '
+    return '\t'
+
+
+def guess_sep(c_filename):
+
+    """Guess separator of contact file from its first contact line.
+    @param  c_filename  contact file name
+    @return ',', ' ' or '\t'
+    """
+
+    with open(c_filename, 'r') as afile:
+        for line in afile:
+            if not NON_DATA.match(line):
+                return get_sep(line.strip())
+    return ' '
+
+
+def read_table(text, sep):
+
+    """Convert contact lines with equal number of columns in one go.
+    @return np.array(CONTACT_DTYPE) or None if lines are irregular
+    """
+
+    if sep.strip():
+        text = text.replace(sep, ' ')
+    num_rows = text.count('\n') + (not text.endswith('\n'))
+    num_cols = len(text.partition('\n')[0].split())
+    if num_cols < 3:
+        return None
+
+    values = np.fromstring(text, sep=' ')
+    if values.size != num_rows * num_cols:
+        return None
+    values = values.reshape(num_rows, num_cols)
+    contacts = np.empty(num_rows, dtype=CONTACT_DTYPE)
+    contacts['i'] = values[:, 0]
+    contacts['j'] = values[:, 1]
+    contacts['score'] = values[:, -1]
+    return contacts
+
+
+def read_lines(lines, sep):
+
+    """Convert contact lines one by one, skipping lines with less than 3 fields.
+    @return np.array(CONTACT_DTYPE)
+    """
+
+    contacts = []
+    for aline in lines:
+        line_arr = aline.replace(sep, ' ').split()
+        # ignore CASP RR format headers
+        if len(line_arr) < 3:
+            continue
+        contacts.append((int(line_arr[0]), int(line_arr[1]), float(line_arr[-1])))
+    return np.array(contacts, dtype=CONTACT_DTYPE)
+
+
+def read_contacts(text, sep='', min_dist=5):
+
+    """Contacts of a complete contact file or of a block of its lines.
+    @return (np.array(CONTACT_DTYPE) in file order, separator)
+    """
+
+    text = NON_DATA.sub('', text)
+    if not text:
+        return (np.zeros(0, dtype=CONTACT_DTYPE), sep)
+    if not sep:
+        sep = get_sep(text.partition('\n')[0].strip())
+
+    contacts = read_table(text, sep)
+    if contacts is None:
+        contacts = read_lines(text.splitlines(), sep)
+    return (contacts[np.abs(contacts['i'] - contacts['j']) >= min_dist], sep)
+
+
+def rank(scores, top=-1):
+
+    """Order of scores from highest to lowest, equal scores keep their order.
+    With top, the top ranked scores are selected in linear time and only
+    those are sorted.
+    @param  scores  np.array of scores
+    @param  top     number of top ranked scores (default: all)
+    @return indices into scores
+    """
+
+    if top < 0 or top >= len(scores):
+        return np.argsort(-scores, kind='mergesort')
+    if top == 0:
+        return np.zeros(0, dtype=int)
+    kth = -np.partition(-scores, top - 1)[top - 1]
+    better = np.nonzero(scores > kth)[0]
+    equal = np.nonzero(scores == kth)[0][:top - len(better)]
+    idx = np.sort(np.concatenate((better, equal)))
+    return idx[np.argsort(-scores[idx], kind='mergesort')]
+
+
+def load(afile, sep='', min_dist=5, top=-1, presorted=False):
+
+    """Read contact file in bulk (PconsC, plmDCA, PSICOV, PhyCMAP, CASP RR).
+    @param  afile       contact file
+    @param  sep         separator of contact file (default: guessed from first contact)
+    @param  min_dist    minimal sequence separation of contacts (default=5)
+    @param  top         only return the top ranked contacts (default: all)
+    @param  presorted   file is sorted by descending score, stop reading
+                        after the top contacts; reads the whole file if the
+                        contacts read so far turn out not to be sorted
+    Ensures: Output is sorted by confidence score, equal scores keep file order.
+    @return np.array([(residue a, residue b, score)], dtype=CONTACT_DTYPE)
+    """
+
+    chunks = [np.zeros(0, dtype=CONTACT_DTYPE)]
+    num_contacts = 0
+    is_sorted = False
+    if presorted and top >= 0:
+        while num_contacts < top:
+            lines = afile.readlines(CHUNKSIZE)
+            if not lines:
+                break
+            contacts, sep = read_contacts(''.join(lines), sep, min_dist)
+            chunks.append(contacts)
+            num_contacts += len(contacts)
+        scores = np.concatenate([c['score'] for c in chunks])
+        is_sorted = not (np.diff(scores) > 0).any()
+
+    if not is_sorted:
+        contacts, sep = read_contacts(afile.read(), sep, min_dist)
+        chunks.append(contacts)
+    afile.close()
+
+    contacts = np.concatenate(chunks)
+    if is_sorted:
+        return contacts[:top]
+    return contacts[rank(contacts['score'], top)]
+
+
 def parse(afile, sep=' ', min_dist=5):
     
     """Parse contact file (PcosnCX, plmDCA, PSICOV, PhyCMAP).
@@ -11,37 +169,25 @@ def parse(afile, sep=' ', min_dist=5):
     Ensures: Output is sorted by confidence score.
     @return [(score, residue a, residue b)]
     """
-    contacts = []
-    for aline in afile:
-        # exclude PhyCmap header/tail lines
-        if aline.strip()[0].isalpha():
-            continue
-        if aline.strip() != '':
-            # ignore CASP RR format headers
-            if len(aline.strip().split(sep)) < 3:
-                continue
-            line_arr = filter(None, aline.strip().split(sep))
-            if line_arr[0].startswith('E'):
-                continue
-            i = int(line_arr[0])
-            j = int(line_arr[1])
-            score = float(line_arr[-1])
-            if abs(i - j) >= min_dist:
-                contacts.append((score, i, j))
-    afile.close()
 
-    contacts.sort(key=lambda x: x[0], reverse=True)
-    return contacts
+    contacts = load(afile, sep, min_dist)
+    return zip(contacts['score'].tolist(), contacts['i'].tolist(), contacts['j'].tolist())
 
 
 def get_numpy_cmap(contacts, seq_len=-1):
 
     """Convert contacts into numpy matrix.
-    @param  contacts    contact list as obtained from "parse"
+    @param  contacts    contact list as obtained from "parse" or array from "load"
     @param  seq_len     sequence length
     @return np.array((seq_len, seq_len), score)
     """
 
+    if isinstance(contacts, np.ndarray):
+        n = int(max(seq_len, contacts['i'].max(), contacts['j'].max()))
+        cmap = np.zeros((n,n))
+        cmap[contacts['i'] - 1, contacts['j'] - 1] = contacts['score']
+        return cmap
+
     max_i = max(contacts, key=lambda(x):x[1])[1]
     max_j = max(contacts, key=lambda(x):x[2])[2]
     n = int(max(seq_len, max_i, max_j))
@@ -56,6 +202,88 @@ def get_numpy_cmap(contacts, seq_len=-1):
 
 
 
+class ContactMap(object):
+
+    """Predicted contacts in coordinate format.
+    Holds the same values as the dense matrix from "get_numpy_cmap":
+    cells without contact count as score 0 and of contacts given more than
+    once the last one in the list is kept.
+    """
+
+    def __init__(self, contacts, seq_len=-1, dtype=np.float64):
+
+        """@param  contacts    contact array as obtained from "load"
+        @param  seq_len     sequence length
+        @param  dtype       score type (default=np.float64, np.float32 halves
+                            the memory of the scores but rounds them)
+        """
+
+        self.n = int(max(seq_len, contacts['i'].max(), contacts['j'].max()))
+        i = contacts['i'] - 1
+        j = contacts['j'] - 1
+        flat = i * self.n + j
+        keep = np.unique(flat[::-1], return_index=True)[1]
+        if len(keep) < len(flat):
+            keep = np.sort(len(flat) - 1 - keep)
+            i, j, contacts = i[keep], j[keep], contacts[keep]
+        self.i = i.astype(np.int32)
+        self.j = j.astype(np.int32)
+        self.score = contacts['score'].astype(dtype)
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    def num_empty(self):
+        return self.n * self.n - len(self.score)
+
+    def count(self, th=0.):
+
+        """Number of cells with score above threshold."""
+
+        num = int(np.count_nonzero(self.score > self.score.dtype.type(th)))
+        if 0 > th:
+            num += self.num_empty()
+        return num
+
+    def max(self):
+
+        """Maximal score of all cells."""
+
+        if len(self.score) == 0:
+            return self.score.dtype.type(0)
+        max_score = self.score.max()
+        if self.num_empty() > 0:
+            max_score = max(max_score, self.score.dtype.type(0))
+        return max_score
+
+    def sub(self, start=0, end=-1):
+
+        """Contacts between residues start <= i, j < end, renumbered from start.
+        @param  end     end of range, -1 for all (slice semantics otherwise)
+        @return ContactMap
+        """
+
+        if end == -1:
+            end = self.n
+        start, end = slice(start, end).indices(self.n)[:2]
+        cmap = ContactMap.__new__(ContactMap)
+        cmap.n = max(end - start, 0)
+        in_range = (self.i >= start) & (self.i < end) & (self.j >= start) & (self.j < end)
+        cmap.i = self.i[in_range] - start
+        cmap.j = self.j[in_range] - start
+        cmap.score = self.score[in_range]
+        return cmap
+
+    def to_dense(self, dtype=np.float64):
+
+        """@return np.array((n, n), dtype), 0 for cells without contact"""
+
+        cmap = np.zeros((self.n, self.n), dtype=dtype)
+        cmap[self.i, self.j] = self.score
+        return cmap
+
+
 def write(contacts, outfile, sep=' '):
 
     """Write contact file.
@@ -71,17 +299,7 @@ def write(contacts, outfile, sep=' '):
 if __name__ == "__main__":
 
     c_filename = sys.argv[1]
-
-    # guessing separator of constraint file
-    line = open(c_filename,'r').readline()
-    if len(line.split(',')) != 1:
-        sep = ','
-    elif len(line.split(' ')) != 1:
-        sep = ' '
-    else:
-        sep = '\t'
-
-    cm = parse(open(c_filename), sep=sep)
+    cm = parse(open(c_filename), sep=guess_sep(c_filename))
 
     for c in cm:
         print c[1], c[2], c[0]
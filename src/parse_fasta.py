@@ -14,30 +14,33 @@ def read_fasta(afile, query_id=''):
 
     seq_dict = {}
     header = ''
-    seq = ''
+    # sequence lines of the current entry, joined once at the next header
+    seq_lines = []
 
     for aline in afile:
         aline = aline.strip()
 
         # check for header
         if aline.startswith('>'):
+            seq = ''.join(seq_lines)
             if header != '' and seq != '':
                 if seq_dict.has_key(header):
                     seq_dict[header].append(seq)
                 else:
                     seq_dict[header] = [seq]
-            seq = ''
+            seq_lines = []
             if aline.startswith('>%s' % query_id) and query_id !='':
                 header = query_id
             else:
                 header = aline[1:]
 
-        # otherwise concatenate sequence
+        # otherwise collect sequence
         else:
             #aline_seq = aline.translate(None, '.-').upper()
-            seq += aline
+            seq_lines.append(aline)
 
     # add last entry
+    seq = ''.join(seq_lines)
     if header != '':
         if seq_dict.has_key(header):
             seq_dict[header].append(seq)
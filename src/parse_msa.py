@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import sys
+import struct
+import argparse
+import numpy as np
+
+import a3m_to_trimmed
+
+
+# Integer encoded alignment of match states (trimmed alignment), one code
+# per residue: index in ALPHABET, GAP for '-' and '.', UNKNOWN for any other
+# character (written back as 'X'). Lower case residues get the code of the
+# upper case residue.
+ALPHABET = 'ACDEFGHIKLMNPQRSTVWY-'
+GAP = ALPHABET.index('-')
+UNKNOWN = len(ALPHABET)
+
+CODES = np.empty(256, dtype=np.uint8)
+CODES.fill(UNKNOWN)
+for i, c in enumerate(ALPHABET):
+    CODES[ord(c)] = i
+    CODES[ord(c.lower())] = i
+CODES[ord('.')] = GAP
+CHARS = np.frombuffer(ALPHABET + 'X', dtype=np.uint8)
+
+# binary file: MAGIC, number of sequences and length (little endian uint64),
+# codes (uint8, one row per sequence) padded to 8 bytes, byte offsets of the
+# name lines in the source alignment (int64)
+MAGIC = 'MSA1'
+HEADER = struct.Struct('<4sQQ')
+
+
+def encode(chars):
+
+    """Codes of an alignment given as characters.
+    @param  chars   np.array((num_seqs, length), uint8), e.g. rows of a3m_to_trimmed.get_rows
+    @return np.array((num_seqs, length), uint8)
+    """
+
+    return CODES[chars]
+
+
+def decode(codes):
+    return CHARS[codes]
+
+
+def read(aln_filename):
+
+    """Encode match states of a3m, trimmed or aligned fasta file (plain or
+    gzip compressed) without keeping the text in memory.
+    @return (np.array((num_seqs, length), uint8) codes,
+             np.array(num_seqs, int64) byte offsets of the name lines,
+             in the uncompressed file)
+    """
+
+    codes = []
+    offsets = []
+    with a3m_to_trimmed.open_alignment(aln_filename) as aln:
+        blocks = a3m_to_trimmed.get_blocks(a3m_to_trimmed.read_chunks(aln))
+        for prefix, rows, name_offsets in a3m_to_trimmed.get_rows(blocks):
+            if len(rows):
+                codes.append(encode(rows))
+                offsets.append(name_offsets)
+    return (np.vstack(codes), np.concatenate(offsets))
+
+
+def write(msa_filename, codes, offsets):
+    num_seqs, length = codes.shape
+    with open(msa_filename, 'wb') as outf:
+        outf.write(HEADER.pack(MAGIC, num_seqs, length))
+        outf.write(np.ascontiguousarray(codes, dtype=np.uint8).tostring())
+        outf.write('\0' * (-codes.size % 8))
+        outf.write(np.asarray(offsets, dtype='<i8').tostring())
+
+
+def is_msa(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load(msa_filename):
+
+    """Map binary alignment file read-only into memory, pages are shared
+    by all processes reading the same file.
+    @return (np.memmap((num_seqs, length), uint8) codes,
+             np.memmap(num_seqs, int64) name line offsets)
+    """
+
+    with open(msa_filename, 'rb') as f:
+        magic, num_seqs, length = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('%s is not a binary alignment file' % msa_filename)
+    if num_seqs * length == 0:
+        return (np.zeros((num_seqs, length), dtype=np.uint8), np.zeros(num_seqs, dtype=np.int64))
+    codes = np.memmap(msa_filename, dtype=np.uint8, mode='r',
+            offset=HEADER.size, shape=(num_seqs, length))
+    offsets = np.memmap(msa_filename, dtype='<i8', mode='r',
+            offset=HEADER.size + num_seqs * length + (-num_seqs * length % 8), shape=(num_seqs,))
+    return (codes, offsets)
+
+
+def read_codes(aln_filename):
+
+    """Codes of binary alignment file or text alignment."""
+
+    if is_msa(aln_filename):
+        return load(aln_filename)[0]
+    return read(aln_filename)[0]
+
+
+def get_trimmed(codes):
+
+    """Trimmed format of encoded alignment, see a3m_to_trimmed.convert.
+    @return generator of trimmed text
+    """
+
+    rows_per_block = max(a3m_to_trimmed.BLOCKSIZE // max(codes.shape[1], 1), 1)
+    if len(codes):
+        yield '>target/1-100\n' + decode(codes[0]).tostring()
+    for start in range(1, len(codes), rows_per_block):
+        yield a3m_to_trimmed.format_rows(decode(codes[start:start + rows_per_block]), start)
+    yield '\n'
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Write a3m, trimmed or aligned\
+            fasta alignment as binary integer encoded alignment.')
+    p.add_argument('alignment', help='Input alignment (may be gzip compressed)')
+    p.add_argument('outfile', help='Output binary alignment file')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    try:
+        codes, offsets = read(args['alignment'])
+    except (IOError, ValueError) as e:
+        sys.exit('ERROR: %s' % e)
+    write(args['outfile'], codes, offsets)
+    print 'N = %d L = %d' % codes.shape
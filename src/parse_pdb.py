@@ -1,5 +1,4 @@
 import sys
-import operator
 import numpy as np
 from collections import defaultdict
 
@@ -144,157 +143,162 @@ def write(pdb_lst, outfile):
     outfile.close()
 
 
-def get_coordinates(pdbfile, chain):
+ATOM_DTYPE = [('chain', 'S1'), ('res_no', 'i4'), ('insert', 'S1'),
+        ('atm_name', 'S4'), ('res_name', 'S3'), ('xyz', 'f8', (3,))]
 
-    res_dict = defaultdict(list)
+THREE_TO_ONE = {'ARG':'R', 'HIS':'H', 'LYS':'K', 'ASP':'D', 'GLU':'E', 'SER':'S', 'THR':'T', 'ASN':'N', 'GLN':'Q', 'CYS':'C', 'GLY':'G', 'PRO':'P', 'ALA':'A', 'ILE':'I', 'LEU':'L', 'MET':'M', 'PHE':'F', 'TRP':'W', 'TYR':'Y', 'VAL':'V', 'UNK': 'X'}
 
-    if not chain:
-        chain = get_first_chain(pdbfile)
-        pdbfile.seek(0)
 
-    for line in pdbfile:
-        if not line.startswith('ATOM'):
-            continue
-        atm_record = parse_atm_record(line)
-        if atm_record['chain'] != ' ' and atm_record['chain'] != chain:
-            continue
+def read_atoms(pdbfile):
 
-        res_i = atm_record['res_no']
-        atm = [atm_record['x'], atm_record['y'], atm_record['z']]
+    """Reads all ATOM records of a pdb file in a single pass.
+    @param  pdbfile     pdb file
+    @return np.array of ATOM_DTYPE records in file order
+    """
 
-        res_dict[res_i].append(np.array(atm))
-        
+    lines = [line.rstrip('\r\n')[:80].ljust(80) for line in pdbfile if line.startswith('ATOM')]
     pdbfile.close()
-    return sorted(res_dict.iteritems(), key=operator.itemgetter(0))
 
+    n = len(lines)
+    atoms = np.zeros(n, dtype=ATOM_DTYPE)
+    if n == 0:
+        return atoms
+    chars = np.frombuffer(''.join(lines), dtype='S1').reshape(n, 80)
 
-def get_res_dict(pdbfile, chain):
+    def column(start, end):
+        return chars[:, start:end].copy().view('S%d' % (end - start)).ravel()
 
-    cb_lst = []
-    res_dict = defaultdict(list)
+    atoms['chain'] = column(21, 22)
+    atoms['res_no'] = column(22, 26).astype(int)
+    atoms['insert'] = column(26, 27)
+    atoms['atm_name'] = np.char.strip(column(12, 16))
+    atoms['res_name'] = np.char.strip(column(17, 20))
+    for k, start in enumerate([30, 38, 46]):
+        atoms['xyz'][:, k] = column(start, start + 8).astype(float)
+    return atoms
+
+
+def get_atoms(pdbfile):
+    # accept both open pdb files and atoms from "read_atoms"
+    if isinstance(pdbfile, np.ndarray):
+        return pdbfile
+    return read_atoms(pdbfile)
+
+
+def select_chain(atoms, chain):
+
+    """Atoms of given chain (default: first chain), atoms without chain
+    identifier are always included.
+    """
 
     if not chain:
-        chain = get_first_chain(pdbfile)
-        pdbfile.seek(0)
+        chain = get_first_chain(atoms)
+    return atoms[(atoms['chain'] == ' ') | (atoms['chain'] == chain)]
 
-    for line in pdbfile:
-        if not line.startswith('ATOM'):
-            continue
 
-        atm_record = parse_atm_record(line)
+def get_res_keys(atoms):
+    # residues with insertion code 'X' are sorted in front
+    return np.where(atoms['insert'] == 'X', atoms['res_no'] * 0.001, atoms['res_no'])
 
-        if atm_record['chain'] != ' ' and atm_record['chain'] != chain:
-            continue
 
-        res_i = atm_record['res_no']
-        
-        if atm_record['insert'] == 'X':
-            res_i = res_i * 0.001
+def get_first_atoms(keys, last=False):
 
-        atm = [float('inf'), float('inf'), float('inf')]
+    """Index of the first (or last) atom of every residue.
+    @param  keys    residue key of each atom
+    @return (sorted unique keys, atom index per key)
+    """
 
-        if atm_record['atm_name'] == 'CA':
-                atm = [atm_record['x'], atm_record['y'], atm_record['z']]
-                res_dict[res_i].append(np.array(atm))   
-        elif atm_record['atm_name'] == 'CB':
-                atm = [atm_record['x'], atm_record['y'], atm_record['z']]
-                res_dict[res_i].append(np.array(atm)) 
-    
-    return res_dict
+    if last:
+        uniq, idx = np.unique(keys[::-1], return_index=True)
+        return uniq, len(keys) - 1 - idx
+    return np.unique(keys, return_index=True)
 
 
-def get_ca_coordinates(pdbfile, chain):
+def get_residue_atoms(pdbfile, chain):
 
-    res_dict = get_res_dict(pdbfile, chain)
+    """Coordinates of all atoms with the index of their residue.
+    Residues are numbered 0..n-1 in order of residue number.
+    @return (np.array((num atoms, 3)), residue index per atom, n)
+    """
 
-    ca_lst = []
+    atoms = select_chain(get_atoms(pdbfile), chain)
+    res_no, res_idx = np.unique(atoms['res_no'], return_inverse=True)
+    return atoms['xyz'], res_idx, len(res_no)
 
-    # need to sort to get the sequence correct
-    sorted_keys = sorted(res_dict.keys())
-    
-    for i in sorted_keys:
-        ca_lst.append(res_dict[i][0])
-    pdbfile.close()
-    return ca_lst
 
+def get_coordinates(pdbfile, chain):
 
-def get_cb_coordinates(pdbfile, chain):
+    """Atom coordinates grouped by residue number.
+    @return [(residue number, [np.array(3) for each atom])] sorted by residue number
+    """
 
-    res_dict = get_res_dict(pdbfile, chain)
+    atoms = select_chain(get_atoms(pdbfile), chain)
+    res_no, res_idx = np.unique(atoms['res_no'], return_inverse=True)
+    order = np.argsort(res_idx, kind='mergesort')
+    bounds = np.cumsum(np.bincount(res_idx, minlength=len(res_no)))[:-1]
+    groups = np.split(atoms['xyz'][order], bounds)
+    return [(res_no[i], list(groups[i])) for i in range(len(res_no))]
 
-    cb_lst = []
-    tmp_i = 0
 
-    # need to sort to get the sequence correct
-    sorted_keys = sorted(res_dict.keys())
-    
-    for i in sorted_keys:
-        if len(res_dict[i]) > 1:
-            tmp_i += 1
-            cb_lst.append(res_dict[i][-1])
-        elif len(res_dict[i]) == 1:
-            tmp_i += 1
-            cb_lst.append(res_dict[i][0])
-    #print atm_count 
-    pdbfile.close()
-    return cb_lst
+def get_res_dict(pdbfile, chain):
 
+    res_dict = defaultdict(list)
+    atoms = select_chain(get_atoms(pdbfile), chain)
+    atoms = atoms[np.in1d(atoms['atm_name'], ['CA', 'CB'])]
+    for key, xyz in zip(get_res_keys(atoms), atoms['xyz']):
+        res_dict[key].append(xyz)
+    return res_dict
 
-def get_atom_seq(pdbfile, chain='', model=1):
 
-    three_to_one = {'ARG':'R', 'HIS':'H', 'LYS':'K', 'ASP':'D', 'GLU':'E', 'SER':'S', 'THR':'T', 'ASN':'N', 'GLN':'Q', 'CYS':'C', 'GLY':'G', 'PRO':'P', 'ALA':'A', 'ILE':'I', 'LEU':'L', 'MET':'M', 'PHE':'F', 'TRP':'W', 'TYR':'Y', 'VAL':'V', 'UNK': 'X'}
-    res_dict = {}
-    
-    in_model = False
- 
-    if not chain:
-        chain = get_first_chain(pdbfile)
-        pdbfile.seek(0)
+def get_ca_coordinates(pdbfile, chain):
 
-    res_name = ''
-    for line in pdbfile:
-        if not line.startswith('ATOM'):
-            continue
-        atm_record = parse_atm_record(line)
-        if atm_record['chain'] != ' ' and atm_record['chain'] != chain:
-            continue
-        if atm_record['atm_name'] != 'CA':
-            continue
+    """Coordinates of the first CA/CB atom of every residue.
+    @return np.array((num residues, 3)) sorted by residue number
+    """
 
-        res_i = atm_record['res_no']
-        if atm_record['insert'] == 'X':
-            res_i = res_i * 0.001
-         
-        #print atm_record['res_name']
-        if atm_record['res_name'] in three_to_one:
-            #res_name = three_to_one[atm_record['res_name']]
-            #print res_name
-            res_name = three_to_one[atm_record['res_name']]
-        #else:
-            #res_name = ''
-            #continue
+    atoms = select_chain(get_atoms(pdbfile), chain)
+    atoms = atoms[np.in1d(atoms['atm_name'], ['CA', 'CB'])]
+    idx = get_first_atoms(get_res_keys(atoms))[1]
+    return atoms['xyz'][idx]
 
-        res_dict[res_i] = res_name
 
-    res_lst = sorted(res_dict.iteritems(), key=operator.itemgetter(0))
-    atom_seq = ''
+def get_cb_coordinates(pdbfile, chain):
 
-    for res in res_lst:
-        atom_seq += res[1]
+    """Coordinates of the CB atom (CA for residues without CB) of every residue.
+    @return np.array((num residues, 3)) sorted by residue number
+    """
 
-    pdbfile.close()
-    return atom_seq
+    atoms = select_chain(get_atoms(pdbfile), chain)
+    atoms = atoms[np.in1d(atoms['atm_name'], ['CA', 'CB'])]
+    idx = get_first_atoms(get_res_keys(atoms), last=True)[1]
+    return atoms['xyz'][idx]
 
 
-def get_first_chain(pdbfile):
+def get_atom_seq(pdbfile, chain='', model=1):
 
-    for line in pdbfile:
-        if not line.startswith('ATOM'):
-            continue
-        atm_record = parse_atm_record(line)
-        break
+    """Amino acid sequence of all residues with a CA atom.
+    Residues with unknown residue names repeat the previous amino acid.
+    @return sequence string
+    """
+
+    atoms = select_chain(get_atoms(pdbfile), chain)
+    atoms = atoms[atoms['atm_name'] == 'CA']
+    if len(atoms) == 0:
+        return ''
+
+    res_names = [THREE_TO_ONE.get(name, '') for name in atoms['res_name']]
+    known = np.array([name != '' for name in res_names])
+    prev_known = np.maximum.accumulate(np.where(known, np.arange(len(atoms)), -1))
+    res_names = np.array(res_names + [''])[prev_known]
+
+    idx = get_first_atoms(get_res_keys(atoms), last=True)[1]
+    return ''.join(res_names[idx])
+
+
+def get_first_chain(pdbfile):
 
-    return atm_record['chain']
+    atoms = get_atoms(pdbfile)
+    return atoms['chain'][0]
  
 
 def get_acc(pdbfile):
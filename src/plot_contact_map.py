@@ -1,4 +1,4 @@
-import sys, os, re, string
+import sys, os
 import argparse
 import numpy as np
 from math import *
@@ -8,14 +8,28 @@ matplotlib.use('Agg')
 from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
+from matplotlib.collections import PatchCollection
 
 import Bio.PDB
-from Bio import pairwise2
 
 import parse_contacts
 import parse_psipred
 import parse_fasta
+import parse_msa
+import msa_stats
 import parse_pdb
+import native_cache
+import residue_map
+import distances
+import ppv
+
+
+# large map mode: contact map image reduced to at most MAP_PIXELS blocks of
+# residues per side, secondary structure elements drawn as one collection,
+# scatter plots and coverage panels rasterized
+MAP_PIXELS = 800
+POOLS = ['max', 'mean']
+SS_COLORS = [('H', '#8B0043'), ('E', '#0080AD')]
 
 
 def s_score(d, d0):
@@ -26,86 +40,17 @@ def s_score_vec(d, d0):
     return f(d, d0)
 
 
-def get_min_dist(res1, res2):
-    
-    min_dist = float('inf')
-
-    for atm1 in res1:
-        for atm2 in res2:
-            diff_vec = atm1 - atm2
-            dist = np.sqrt(np.sum(diff_vec * diff_vec))
-            if dist < min_dist:
-                min_dist = dist
-
-    return min_dist
-
-
-def get_heavy_contacts(gapped_res_lst):
-
-    seqlen = len(gapped_res_lst)
-    dist_mat = np.zeros((seqlen, seqlen), np.float)
-    dist_mat.fill(float('inf'))
-    
-    for i, res1 in enumerate(gapped_res_lst):
-        if res1 == '-':
-            continue
-        for j, res2 in enumerate(gapped_res_lst):
-            if res2 == '-':
-                continue
-            dist_mat[i,j] = get_min_dist(res1[1], res2[1])
-    return dist_mat
-
-
-def get_cb_contacts(gapped_cb_lst):
-
-    seqlen = len(gapped_cb_lst)
-    dist_mat = np.zeros((seqlen, seqlen), np.float)
-    dist_mat.fill(float('inf'))
-    
-    #offset = 0
-    #first_i = gapped_cb_lst[0].keys()[0]
-    #if first_i < 0:
-    #    offset = abs(first_i)
-
-    for i, cb1 in enumerate(gapped_cb_lst):
-        if cb1 == '-':
-            continue
-        for j, cb2 in enumerate(gapped_cb_lst):
-            if cb2 == '-':
-                continue
-            diff_vec = cb1 - cb2
-            #dist_mat[i+offset,j+offset] = np.sqrt(np.sum(diff_vec * diff_vec))
-            dist_mat[i,j] = np.sqrt(np.sum(diff_vec * diff_vec))
-    return dist_mat
-
-
-
-def get_ppvs(contacts_x, contacts_y, ref_contact_map, atom_seq_ali, ref_len, factor):
-
-    PPVs = []
-    TPs = []
-    FPs = []
-
-    for num_c in range(min(len(contacts_x), int(ceil(ref_len * factor))) + 1)[1:]:
-        TP = 0.0
-        FP = 0.0
-        for i in range(num_c):
-            c_x = contacts_x[i]
-            c_y = contacts_y[i]
-            if atom_seq_ali[c_x] == '-':
-                continue
-            if atom_seq_ali[c_y] == '-':
-                continue
-            if ref_contact_map[c_x, c_y] > 0:
-                TP += 1.0 / (ref_len*factor)
-            else:
-                FP += 1.0 / (ref_len*factor)
+def get_ppvs(contacts_x, contacts_y, ref_contact_map, ali_mask, ref_len, factor):
 
-        if TP > 0.0:
-            PPVs.append(TP / (TP + FP))
-            TPs.append(TP)
-            FPs.append(FP)
+    num_c = min(len(contacts_x), int(ceil(ref_len * factor)))
+    tp, fp = ppv.label_contacts(contacts_x[:num_c], contacts_y[:num_c], ref_contact_map, ali_mask)
+    ppv_curve, num_tp, num_fp = ppv.get_ppv_curve(tp, fp)
 
+    # only report list lengths with at least one TP
+    has_tp = num_tp > 0
+    PPVs = ppv_curve[has_tp].tolist()
+    TPs = (num_tp[has_tp] / (ref_len * factor)).tolist()
+    FPs = (num_fp[has_tp] / (ref_len * factor)).tolist()
 
     if len(PPVs) == 0:
         PPVs.append(0.0)
@@ -117,104 +62,219 @@ def get_ppvs(contacts_x, contacts_y, ref_contact_map, atom_seq_ali, ref_len, fac
     return PPVs, TPs, FPs
 
 
-def get_tp_colors(contacts_x, contacts_y, ref_contact_map, atom_seq_ali):
-
-    tp_colors = []
-
-    for i in range(len(contacts_x)):
-        c_x = contacts_x[i]
-        c_y = contacts_y[i]
-        if atom_seq_ali[c_x] == '-':
-            #tp_colors.append('green')
-            tp_colors.append('red')
-            continue
-        if atom_seq_ali[c_y] == '-':
-            #tp_colors.append('green')
-            tp_colors.append('red')
-            continue
-        if ref_contact_map[c_x, c_y] > 0:
-            tp_colors.append('blue')
-        else:
-            tp_colors.append('red')
+def get_tp_colors(contacts_x, contacts_y, ref_contact_map, ali_mask):
 
-    return tp_colors
+    # unaligned contacts are shown as false positives
+    tp = ppv.label_contacts(contacts_x, contacts_y, ref_contact_map, ali_mask)[0]
+    return ['blue' if is_tp else 'red' for is_tp in tp]
  
 
-def get_colors(contacts_np, ref_contact_map=[], atom_seq_ali=[], th=0.5):
+def get_cell_colors(sc, dist=None, th=0.5):
+
+    """RGBA colors of contact map cells, see "get_colors".
+    @param  sc      np.array(n) contact scores, cells with NaN score stay white
+    @param  dist    np.array(n) native distances (default: none)
+    @return np.array((n, 4))
+    """
+
+    colors = np.ones((len(sc), 4))
+    # NaN scores and distances of empty cells compare as False
+    with np.errstate(invalid='ignore'):
+        pred = sc > th
+
+        if dist is not None:
+            native = dist < 8
+            # FN
+            colors[~pred & ~np.isnan(sc) & native] = [0.5,0.5,0.5,1]
+            # TP
+            colors[pred & native] = [0,1,0,1]
+            # FP
+            colors[pred & (dist >= 12)] = [1,0,0,1]
+            # grey zone between 8 and 12 Angstroem
+            grey = pred & (dist >= 8) & (dist < 12)
+            val = (dist[grey] - 8)/(12 - 8)
+            colors[grey, 0] = 0.5+val/2
+            colors[grey, 1] = 1-val/2
+            colors[grey, 2] = 0
+        else:
+            colors[pred, 0] = 0.5-sc[pred]/2
+            colors[pred, 1] = 0.5-sc[pred]/2
+    return colors
+
+
+def get_cell_ranks(sc, dist=None, th=0.5):
+
+    """Priority of contact map cells shown as one block: with native
+    distances FP, TP, 8 - 12 Angstroem (closer to 12 first), FN, others,
+    without the score. Cells with NaN score come last.
+    @return np.array(n)
+    """
+
+    if dist is None:
+        return np.where(np.isnan(sc), -np.inf, sc)
+    ranks = np.zeros(len(sc))
+    with np.errstate(invalid='ignore'):
+        pred = sc > th
+        ranks[~pred & (dist < 8)] = 1
+        grey = pred & (dist >= 8) & (dist < 12)
+        ranks[grey] = 2 + (dist[grey] - 8)/(12 - 8)
+        ranks[pred & (dist < 8)] = 3
+        ranks[pred & (dist >= 12)] = 4
+    ranks[np.isnan(sc)] = -1
+    return ranks
+
+
+def get_colors(contacts_np, ref_contact_map=[], th=0.5):
+
+    """RGBA image of the contact map, the scores of the upper triangle
+    (sequence separation >= 5) are shown in both triangles.
+    With native distances: TP green, FP (>= 12 Angstroem) red, 8 - 12
+    Angstroem from green to red, FN grey. Without: score above th in blue.
+    @param  contacts_np     np.array((N, N)) contact scores
+    @param  ref_contact_map np.array((N, N)) native distances (default: none)
+    @return np.array((N, N, 4))
+    """
 
     N = contacts_np.shape[0]
     img = np.ones((N,N,4))
+    i, j = np.triu_indices(N, 5)
+    dist = None
+    if len(ref_contact_map) > 0:
+        assert N == ref_contact_map.shape[0]
+        dist = np.asarray(ref_contact_map)[i, j]
+    colors = get_cell_colors(np.asarray(contacts_np)[i, j], dist, th)
+
+    img[i, j] = colors
+    img[j, i] = colors
+    return img
+
 
-    for i in xrange(N):
-        for j in xrange(N):
-            if j < (i+5):
-                continue
-            sc = contacts_np[i,j]
+def get_image(contacts_np, ref_contact_map=[], th=0.5, block=1, pool='max'):
+
+    """Contact map image (see "get_colors") of blocks of block x block
+    residues. Residue pairs (sequence separation >= 5) are colored first,
+    a block then shows its pair ranked highest by "get_cell_ranks" (pool
+    'max') or the mean color of its pairs (pool 'mean').
+    @return (np.array((n, n, 4)), imshow extent in residue coordinates)
+    """
+
+    N = len(contacts_np)
+    if block <= 1:
+        return (get_colors(contacts_np, ref_contact_map, th), None)
+    num_blocks = -(-N // block)
+    size = num_blocks * block
+    contacts_np = np.asarray(contacts_np)
+
+    def by_block(cells):
+        # (block * size, ...) cells of a row of blocks -> (num_blocks, block * block, ...)
+        cells = cells.reshape(block, num_blocks, block, -1).swapaxes(0, 1)
+        return cells.reshape(num_blocks, block * block, -1)
+
+    # one row of blocks at a time, the lower triangle shows the upper one
+    img = np.ones((num_blocks, num_blocks, 4))
+    cols = np.arange(N)
+    for row_block in range(num_blocks):
+        rows = np.arange(row_block * block, min(row_block * block + block, N))
+        first = np.minimum.outer(rows, cols)
+        second = np.maximum.outer(rows, cols)
+        sc = np.empty((block, size))
+        sc.fill(np.nan)
+        sc[:len(rows), :N] = np.where(second - first >= 5, contacts_np[first, second], np.nan)
+        sc = sc.ravel()
+        dist = None
+        if len(ref_contact_map) > 0:
+            dist = np.empty((block, size))
+            dist.fill(np.nan)
+            dist[:len(rows), :N] = np.asarray(ref_contact_map)[first, second]
+            dist = dist.ravel()
+
+        colors = by_block(get_cell_colors(sc, dist, th))
+        if pool == 'max':
+            best = by_block(get_cell_ranks(sc, dist, th))[:, :, 0].argmax(axis=1)
+            img[row_block] = colors[np.arange(num_blocks), best]
+        else:
+            scored = by_block(~np.isnan(sc))
+            count = scored.sum(axis=1)
+            total = (colors * scored).sum(axis=1)
+            img[row_block] = np.where(count > 0, total / np.maximum(count, 1), 1.)
+    return (img, (-0.5, size - 0.5, size - 0.5, -0.5))
+
+
+def get_ss_segments(ss, state):
+
+    """Runs of a secondary structure state.
+    @return [(first residue, length)]
+    """
+
+    is_state = np.frombuffer(ss, dtype=np.uint8) == ord(state)
+    edges = np.diff(np.r_[0, is_state.astype(int), 0])
+    starts = np.flatnonzero(edges == 1)
+    return zip(starts.tolist(), (np.flatnonzero(edges == -1) - starts).tolist())
+
+
+def make_tiles(contacts_np, ref_contact_map=[], th=0.5, tile=500, name='', start=0):
+
+    """Full resolution views of the contact map in tiles of tile x tile
+    residues (upper triangle and diagonal).
+    @return [(label, figure)], label: first-last residue of rows and columns
+    """
+
+    N = len(contacts_np)
+    tiles = []
+    for row_start in range(0, N, tile):
+        for col_start in range(row_start, N, tile):
+            rows = np.arange(row_start, min(row_start + tile, N))
+            cols = np.arange(col_start, min(col_start + tile, N))
+            first = np.minimum.outer(rows, cols)
+            second = np.maximum.outer(rows, cols)
+            sc = np.where(second - first >= 5, np.asarray(contacts_np)[first, second], np.nan)
+            dist = None
             if len(ref_contact_map) > 0:
-                assert N == ref_contact_map.shape[0]
-                # FN
-                if sc <= th and ref_contact_map[i,j] < 8:
-                    #img[i,j] = [0.5,0.5,1,1]
-                    img[i,j] = [0.5,0.5,0.5,1]
-                    img[j,i] = [0.5,0.5,0.5,1]
-                # TP
-                elif sc > th and ref_contact_map[i,j] < 8:
-                    img[i,j] = [0,1,0,1]
-                    img[j,i] = [0,1,0,1]
-                    #img[j,i] = [1-sc,1-sc,1-sc,1]
-                # FP
-                #elif contacts_np[i,j] > th and ref_contact_map[i,j] >= 8:
-                elif sc > th and ref_contact_map[i,j] >= 12:
-                    img[i,j] = [1,0,0,1]
-                    img[j,i] = [1,0,0,1]
-                    #img[j,i] = [1-sc,1-sc,1-sc,1]
-                # grey zone between 8 and 12 Angstroem
-                elif sc > th and (ref_contact_map[i,j] < 12 or ref_contact_map[i,j] >= 8):
-                    val = (ref_contact_map[i,j] - 8)/(12 - 8)
-                    img[i,j] = [0.5+val/2,1-val/2,0,1]
-                    img[j,i] = [0.5+val/2,1-val/2,0,1]
-                    #img[j,i] = [1-sc,1-sc,1-sc,1]
-            else:
-                if sc > th:
-                    img[i,j] = [0.5-sc/2,0.5-sc/2,1,1]
-                    img[j,i] = [0.5-sc/2,0.5-sc/2,1,1]
+                dist = np.asarray(ref_contact_map)[first, second].ravel()
+            img = get_cell_colors(sc.ravel(), dist, th).reshape(len(rows), len(cols), 4)
 
-    return img
+            label = '%d-%d_%d-%d' % (start + rows[0] + 1, start + rows[-1] + 1,
+                    start + cols[0] + 1, start + cols[-1] + 1)
+            fig = plt.figure(figsize=(8, 8), dpi=96, facecolor='w')
+            ax = fig.add_subplot(111)
+            ax.imshow(img, interpolation='none',
+                    extent=(cols[0] - 0.5, cols[-1] + 0.5, rows[-1] + 0.5, rows[0] - 0.5))
+            ax.axis([cols[0] - 0.5, cols[-1] + 0.5, rows[0] - 0.5, rows[-1] + 0.5])
+            ax.tick_params(direction='out', right='off', top='off')
+            ax.grid()
+            fig.suptitle('%s\nresidues %s' % (name, label.replace('_', ' x ')))
+            tiles.append((label, fig))
+    return tiles
 
 
-def get_seqlen(filename):
-    alifile = open(filename, 'r')
-    l = alifile.readline()
-    if l.startswith('>'):
-        L = len(alifile.readline().strip())
-    else:
-        L = len(l.strip())
-    alifile.close()
-    return L
+def get_ali_stat(filename, stat='coverage'):
+
+    """Per column statistic of an a3m, trimmed or binary alignment, see
+    msa_stats.STATS.
+    """
+
+    stats = msa_stats.get_stats(parse_msa.read_codes(filename))
+    return stats[stat].tolist()
 
 
 def get_ali_coverage(filename):
-    L = get_seqlen(filename)
-    N = 0
-    alifile = open(filename, 'r')
-    coverage = dict.fromkeys(range(L), 0)
-    for line in alifile:
-        # ignore headers
-        if line.startswith('>'):
-            continue
-        # remove possible inserts
-        line = line.translate(None,string.ascii_lowercase)
-        pos_lst = [m.start() for m in re.finditer('-', line)]
-        for pos in pos_lst:
-            coverage[pos] += 1
-        N += 1
-    alifile.close()
-    #coverage_lst = [1-(coverage[i]/float(N)) for i in range(L)]
-    coverage_lst = [N - coverage[i] for i in range(L)]
-    return coverage_lst
-
-
-def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psipred_horiz_fname='', psipred_vert_fname='', pdb_filename='', is_heavy=False, chain='', sep=',', outfilename='', ali_filename='', name='', start=0, end=-1):  
+    return get_ali_stat(filename, 'coverage')
+
+
+def make_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psipred_horiz_fname='', psipred_vert_fname='', pdb_filename='', is_heavy=False, chain='', sep=',', ali_filename='', name='', start=0, end=-1, cache_dir='', ali_stat='coverage', aligner='pairwise2', large=False, block=0, pool='max', tile=0):
+
+    """Draw contact map figure, see "plot_map".
+    @param  large   large map mode, see MAP_PIXELS
+    @param  block   residues per image pixel (default: 1, in large map mode
+                    at most MAP_PIXELS pixels)
+    @param  pool    reduction of the residue pairs of a block, one of POOLS
+                    (see "get_image")
+    @param  tile    size of additional full resolution tiles (default: none)
+    @return (figure, {'name': str} with 'PPV', 'TP', 'FP' of the top
+             factor * L contacts if a pdb file is given, 'PPV2', 'TP2',
+             'FP2' of the second contact map and 'tiles' as obtained from
+             "make_tiles")
+    """
   
     #acc = c_filename.split('.')[0]
     #acc = fasta_filename.split('.')[0][:4]
@@ -237,9 +297,8 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
 
 
     ### get top "factor" * "ref_len" predicted contacts
-    contacts = parse_contacts.parse(open(c_filename, 'r'), sep)
-    contacts_np = parse_contacts.get_numpy_cmap(contacts)
-    contacts_np = contacts_np[start:end,start:end]
+    contacts = parse_contacts.load(open(c_filename, 'r'), sep)
+    contacts_np = parse_contacts.ContactMap(contacts).sub(start, end).to_dense()
 
     contacts_x = []
     contacts_y = []
@@ -247,10 +306,8 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
     contact_dict = {}
 
     count = 0
-    for i in range(len(contacts)):
-        score = contacts[i][0]
-        c_x = contacts[i][1] - 1
-        c_y = contacts[i][2] - 1
+    for score, c_x, c_y in zip(contacts['score'].tolist(),
+            (contacts['i'] - 1).tolist(), (contacts['j'] - 1).tolist()):
         
         # only look at contacts within given range
         # default: take full sequence range into account
@@ -273,7 +330,12 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
             break
  
 
+    if not block:
+        block = int(ceil(ref_len / float(MAP_PIXELS))) if large else 1
+    dist_mat = []
+
     ### start plotting
+    stats = {'name': acc}
     fig = plt.figure(figsize=(8, 8), dpi=96, facecolor='w')
     ax = fig.add_subplot(111)#, aspect='auto')
     ax.set_adjustable('box-forced')
@@ -292,7 +354,7 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
         ax.set_xlim([-unit,ref_len])
         ax.set_ylim([-unit,ref_len])
 
-        coverage_lst = get_ali_coverage(ali_filename)
+        coverage_lst = get_ali_stat(ali_filename, ali_stat)
         coverage_lst = coverage_lst[start:end]
         max_cover = max(coverage_lst)
         #lt = pow(10, max(1,floor(log10(max_cover)) - 1))
@@ -308,7 +370,7 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
         ax2.axvline(x=max_cover*0.25, lw=0.5, c='black', ls=':')
         ax2.axvline(x=max_cover*0.5, lw=0.5, c='black', ls=':')
         ax2.axvline(x=max_cover*0.75, lw=0.5, c='black', ls=':')
-        ax2.fill([0]+coverage_lst+[0], [0]+range(ref_len)+[ref_len-1], facecolor='gray', lw=0, alpha=0.5)
+        ax2.fill([0]+coverage_lst+[0], [0]+range(ref_len)+[ref_len-1], facecolor='gray', lw=0, alpha=0.5, rasterized=large)
         ax2.set_xticks([0, max_cover])
         ax2.tick_params(axis='x', top='off', direction='out')
         ax2.invert_xaxis()
@@ -327,7 +389,7 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
         ax3.axhline(y=max_cover*0.25, lw=0.5, c='black', ls=':')
         ax3.axhline(y=max_cover*0.5, lw=0.5, c='black', ls=':')
         ax3.axhline(y=max_cover*0.75, lw=0.5, c='black', ls=':')
-        ax3.fill([0]+range(ref_len)+[ref_len-1], [0]+coverage_lst+[0], facecolor='gray', lw=0, alpha=0.5)
+        ax3.fill([0]+range(ref_len)+[ref_len-1], [0]+coverage_lst+[0], facecolor='gray', lw=0, alpha=0.5, rasterized=large)
         #ax3.xaxis.tick_top()
         ax3.set_yticks([0, max_cover])
         ax3.tick_params(labelbottom='off')
@@ -352,89 +414,53 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
  
         ax.axhline(y=0, lw=1, c='black')
         ax.axvline(x=0, lw=1, c='black')
-        for i in range(len(ss)):
-            if ss[i] == 'H':
-                #ax.plot(-unit/2, i, 's', c='#8B0043', mec="#8B0043")#, markersize=2)
-                #ax.plot(i, -unit/2, 's', c='#8B0043', mec="#8B0043")#, markersize=2)
-                #ax.plot(i, -unit/2, 's', c='#8B0043', mec="#8B0043")#, markersize=2)
-                ax.add_patch(plt.Rectangle((-unit, i-0.5), unit, 1, edgecolor='#8B0043', facecolor="#8B0043"))
-                ax.add_patch(plt.Rectangle((i-0.5, -unit), 1, unit, edgecolor='#8B0043', facecolor="#8B0043"))
-            if ss[i] == 'E':
-                ax.add_patch(plt.Rectangle((-unit, i-0.5), unit, 1, edgecolor='#0080AD', facecolor="#0080AD"))
-                ax.add_patch(plt.Rectangle((i-0.5, -unit), 1, unit, edgecolor='#0080AD', facecolor="#0080AD"))
-                #ax.plot(-unit/2, i, 's', c='#0080AD', mec="#0080AD")#, markersize=2)
-                #ax.plot(i, -unit/2, 's', c='#0080AD', mec="#0080AD")#, markersize=2)
-            if ss[i] == 'C':
-                continue
+        if large:
+            for state, color in SS_COLORS:
+                segments = get_ss_segments(ss, state)
+                ax.add_collection(PatchCollection([plt.Rectangle((-unit, i-0.5), unit, n) for i, n in segments], edgecolor=color, facecolor=color))
+                ax.add_collection(PatchCollection([plt.Rectangle((i-0.5, -unit), n, unit) for i, n in segments], edgecolor=color, facecolor=color))
+        else:
+            for i in range(len(ss)):
+                if ss[i] == 'H':
+                    #ax.plot(-unit/2, i, 's', c='#8B0043', mec="#8B0043")#, markersize=2)
+                    #ax.plot(i, -unit/2, 's', c='#8B0043', mec="#8B0043")#, markersize=2)
+                    #ax.plot(i, -unit/2, 's', c='#8B0043', mec="#8B0043")#, markersize=2)
+                    ax.add_patch(plt.Rectangle((-unit, i-0.5), unit, 1, edgecolor='#8B0043', facecolor="#8B0043"))
+                    ax.add_patch(plt.Rectangle((i-0.5, -unit), 1, unit, edgecolor='#8B0043', facecolor="#8B0043"))
+                if ss[i] == 'E':
+                    ax.add_patch(plt.Rectangle((-unit, i-0.5), unit, 1, edgecolor='#0080AD', facecolor="#0080AD"))
+                    ax.add_patch(plt.Rectangle((i-0.5, -unit), 1, unit, edgecolor='#0080AD', facecolor="#0080AD"))
+                    #ax.plot(-unit/2, i, 's', c='#0080AD', mec="#0080AD")#, markersize=2)
+                    #ax.plot(i, -unit/2, 's', c='#0080AD', mec="#0080AD")#, markersize=2)
+                if ss[i] == 'C':
+                    continue
 
 
     ### plot reference contacts in the background if given
     if pdb_filename:
-        res_lst = parse_pdb.get_coordinates(open(pdb_filename, 'r'), chain)
-        cb_lst = parse_pdb.get_cb_coordinates(open(pdb_filename, 'r'), chain)
-        atom_seq = parse_pdb.get_atom_seq(open(pdb_filename, 'r'), chain)
-                
-        align = pairwise2.align.globalms(atom_seq, seq, 2, -1, -0.5, -0.1)
-
-        atom_seq_ali = align[-1][0]
-        seq_ali = align[-1][1]
-
-        #print atom_seq_ali
-        #print seq_ali
-
-        j = 0
-        gapped_res_lst = []
-        gapped_cb_lst = []
-
-        for i in xrange(len(atom_seq_ali)):
-            if atom_seq_ali[i] == '-':
-                gapped_res_lst.append('-')
-                gapped_cb_lst.append('-')
-            elif seq_ali[i] == '-':
-                j += 1
-                continue
-            else:
-                gapped_res_lst.append(res_lst[j])
-                gapped_cb_lst.append(cb_lst[j])
-                j += 1
+        if is_heavy:
+            native = native_cache.get_native(pdb_filename, chain, 'heavy', cache_dir)
+        else:
+            native = native_cache.get_native(pdb_filename, chain, 'CB', cache_dir)
+        ali_idx = residue_map.get_map(native['atom_seq'], seq, cache_dir=cache_dir, aligner=aligner)
+        ali_mask = ali_idx >= 0
 
+        # heavy atom distances are only known up to 12 Angstroem,
+        # all larger distances are inf
+        dist_mat = distances.get_gapped_dist_mat(native['dist_mat'], ali_idx)
         if is_heavy:
-            dist_mat = get_heavy_contacts(gapped_res_lst)
             heavy_cutoff = 5
             ref_contact_map = dist_mat < heavy_cutoff
-            ref_contacts = np.where(dist_mat < heavy_cutoff)
         else:
-            dist_mat = get_cb_contacts(gapped_cb_lst)
             cb_cutoff = 8
             ref_contact_map = dist_mat < cb_cutoff
-            ref_contacts = np.where(dist_mat < cb_cutoff)
-            #ref_contacts = np.where(np.ma.array(dist_mat, mask=np.tri(dist_mat.shape[0]), fill_value=float("inf")) < cb_cutoff)
-        
-        ref_contacts_x = ref_contacts[0]
-        ref_contacts_y = ref_contacts[1]
 
-        PPVs, TPs, FPs = get_ppvs(contacts_x, contacts_y, ref_contact_map, atom_seq_ali, ref_len, factor)
-        tp_colors = get_tp_colors(contacts_x, contacts_y, ref_contact_map, atom_seq_ali)
-        img = get_colors(contacts_np, ref_contact_map=dist_mat, atom_seq_ali=atom_seq_ali, th=th)
-        sc = ax.imshow(img, interpolation='none')
+        PPVs, TPs, FPs = get_ppvs(contacts_x, contacts_y, ref_contact_map, ali_mask, ref_len, factor)
+        tp_colors = get_tp_colors(contacts_x, contacts_y, ref_contact_map, ali_mask)
+        img, extent = get_image(contacts_np, ref_contact_map=dist_mat, th=th, block=block, pool=pool)
+        sc = ax.imshow(img, interpolation='none', extent=extent)
    
-        print '%s %s %s %s' % (acc, PPVs[-1], TPs[-1], FPs[-1])
-      
-        cmap = cm.get_cmap("binary")
-        cmap.set_bad([1,1,1,0])
-        dist_mat_masked = np.ma.array(dist_mat, mask=np.tri(dist_mat.shape[0], k=-1))
-        #sc = ax.imshow(s_score_vec(dist_mat_masked, 5), cmap=cmap, interpolation='none')
-        
-        ref_contacts_diag_x = []
-        ref_contacts_diag_y = []
-        for i in range(len(ref_contacts_x)):
-            x_i = ref_contacts_x[i]
-            y_i = ref_contacts_y[i]
-            if not dist_mat_masked.mask[x_i, y_i] and abs(x_i - y_i) >= 5:
-                ref_contacts_diag_x.append(x_i)
-                ref_contacts_diag_y.append(y_i)
-       
-        #ax.scatter(ref_contacts_diag_x, ref_contacts_diag_y, marker='+', c='#000000')
+        stats.update({'PPV': PPVs[-1], 'TP': TPs[-1], 'FP': FPs[-1]})
 
 
     ### plot predicted contacts from second contact map if given
@@ -466,15 +492,15 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
 
         ### use TP/FP color coding if reference contacts given
         if pdb_filename:
-            PPVs2, TPs2, FPs2 = get_ppvs(contacts2_x, contacts2_y, ref_contact_map, atom_seq_ali, ref_len, factor)
-            tp2_colors = get_tp_colors(contacts2_x, contacts2_y, ref_contact_map, atom_seq_ali)
-            print '%s %s %s %s' % (acc, PPVs2[-1], TPs2[-1], FPs2[-1])
+            PPVs2, TPs2, FPs2 = get_ppvs(contacts2_x, contacts2_y, ref_contact_map, ali_mask, ref_len, factor)
+            tp2_colors = get_tp_colors(contacts2_x, contacts2_y, ref_contact_map, ali_mask)
+            stats.update({'PPV2': PPVs2[-1], 'TP2': TPs2[-1], 'FP2': FPs2[-1]})
             fig.suptitle('%s\nPPV (upper left) = %.2f | PPV (lower right) = %.2f' % (acc, PPVs[-1], PPVs2[-1]))
-            sc = ax.scatter(contacts2_y[::-1], contacts2_x[::-1], marker='o', c=tp2_colors[::-1], s=6, alpha=0.75, lw=0)
-            sc = ax.scatter(contacts_x[::-1], contacts_y[::-1], marker='o', c=tp_colors[::-1], s=6, alpha=0.75, lw=0)
+            sc = ax.scatter(contacts2_y[::-1], contacts2_x[::-1], marker='o', c=tp2_colors[::-1], s=6, alpha=0.75, lw=0, rasterized=large)
+            sc = ax.scatter(contacts_x[::-1], contacts_y[::-1], marker='o', c=tp_colors[::-1], s=6, alpha=0.75, lw=0, rasterized=large)
         else:
-            sc = ax.scatter(contacts2_y[::-1], contacts2_x[::-1], marker='o', c='#D70909', edgecolor='#D70909', s=6, linewidths=0.5)
-            sc = ax.scatter(contacts_x[::-1], contacts_y[::-1], marker='o', c='#004F9D', edgecolor='#004F9D', s=6, linewidths=0.5)
+            sc = ax.scatter(contacts2_y[::-1], contacts2_x[::-1], marker='o', c='#D70909', edgecolor='#D70909', s=6, linewidths=0.5, rasterized=large)
+            sc = ax.scatter(contacts_x[::-1], contacts_y[::-1], marker='o', c='#004F9D', edgecolor='#004F9D', s=6, linewidths=0.5, rasterized=large)
 
 
     ### plot predicted contacts from first contact map on both triangles
@@ -506,8 +532,8 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
             #sc = ax.imshow(contacts_np + contacts_np.T, cmap=cm.hot_r)
             #sc = ax.imshow(contacts_np + contacts_np.T,
             #        cmap=cm.binary, vmin=th, vmax=1.0, interpolation='none')
-            img = get_colors(contacts_np, th=th)
-            sc = ax.imshow(img, interpolation='none')
+            img, extent = get_image(contacts_np, th=th, block=block, pool=pool)
+            sc = ax.imshow(img, interpolation='none', extent=extent)
             #divider1 = make_axes_locatable(ax)
             #cax1 = divider1.append_axes("right", size="2%", pad=0.05)
             #plt.colorbar(sc, cax=cax1)
@@ -528,21 +554,57 @@ def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psi
     #ax.invert_yaxis()
     ax.set_autoscale_on(False) 
 
-    if outfilename:
-        if outfilename.endswith('.pdf'):
-            pp = PdfPages(outfilename)
-            pp.savefig(fig)
-            pp.close()
-        elif outfilename.endswith('.png'):
-            plt.savefig(outfilename)
-        else:
-            pp = PdfPages('%s.pdf' % outfilename)
-            pp.savefig(fig)
-            pp.close()
-    else:
-        pp = PdfPages('%s_ContactMap.pdf' % c_filename)
-        pp.savefig(fig)
-        pp.close()
+    if tile:
+        stats['tiles'] = make_tiles(contacts_np, dist_mat, th=th, tile=tile, name=acc, start=start)
+    return (fig, stats)
+
+
+def save_map(fig, outfilename, tiles=[]):
+
+    """Write figure to .png or .pdf file (.pdf is appended to other names).
+    Tiles (see "make_tiles") are further pdf pages or png files named
+    outfilename_tile_LABEL.png.
+    """
+
+    if outfilename.endswith('.png'):
+        fig.savefig(outfilename)
+        for label, tile_fig in tiles:
+            tile_fig.savefig('%s_tile_%s.png' % (outfilename[:-len('.png')], label))
+        return
+    if not outfilename.endswith('.pdf'):
+        outfilename = '%s.pdf' % outfilename
+    pp = PdfPages(outfilename)
+    pp.savefig(fig)
+    for label, tile_fig in tiles:
+        pp.savefig(tile_fig)
+    pp.close()
+
+
+def plot_map(fasta_filename, c_filename, factor=1.0, th=0.5, c2_filename='', psipred_horiz_fname='', psipred_vert_fname='', pdb_filename='', is_heavy=False, chain='', sep=',', outfilename='', ali_filename='', name='', start=0, end=-1, cache_dir='', ali_stat='coverage', aligner='pairwise2', large=False, block=0, pool='max', tile=0):
+
+    """Plot contact map to outfilename (default: contact file + _ContactMap.pdf)
+    and print PPV, TP and FP fraction of the top factor * L contacts if a pdb
+    file is given.
+    @return statistics as obtained from "make_map"
+    """
+
+    fig, stats = make_map(fasta_filename, c_filename, factor=factor, th=th,
+            c2_filename=c2_filename, psipred_horiz_fname=psipred_horiz_fname,
+            psipred_vert_fname=psipred_vert_fname, pdb_filename=pdb_filename,
+            is_heavy=is_heavy, chain=chain, sep=sep, ali_filename=ali_filename,
+            name=name, start=start, end=end, cache_dir=cache_dir,
+            ali_stat=ali_stat, aligner=aligner, large=large, block=block,
+            pool=pool, tile=tile)
+    tiles = stats.pop('tiles', [])
+    for suffix in ['', '2']:
+        if 'PPV' + suffix in stats:
+            print '%s %s %s %s' % (stats['name'], stats['PPV' + suffix],
+                    stats['TP' + suffix], stats['FP' + suffix])
+    save_map(fig, outfilename or '%s_ContactMap.pdf' % c_filename, tiles)
+    plt.close(fig)
+    for label, tile_fig in tiles:
+        plt.close(tile_fig)
+    return stats
 
 
     
@@ -561,9 +623,16 @@ if __name__ == "__main__":
     p.add_argument('--heavy', action='store_true')
     p.add_argument('--chain', default='')
     p.add_argument('--alignment', default='')
+    p.add_argument('--alistat', default='coverage', choices=msa_stats.STATS, help='Alignment column statistic shown next to the map (default: coverage)')
     p.add_argument('--name', default='')
     p.add_argument('--start', default=0, type=int)
     p.add_argument('--end', default=-1, type=int)
+    p.add_argument('--cachedir', default='')
+    p.add_argument('--aligner', default='pairwise2', choices=sorted(residue_map.ALIGNERS), help='Aligner mapping the sequence onto the structure, "anchored" for long near-identical sequences (default: pairwise2)')
+    p.add_argument('--large', action='store_true', help='Large map mode: reduced map image, secondary structure as collections, rasterized scatter plots')
+    p.add_argument('--block', default=0, type=int, help='Residues per map pixel (default: 1, with --large at most %d pixels)' % MAP_PIXELS)
+    p.add_argument('--pool', default='max', choices=POOLS, help='Reduction of the residue pairs of a block: highest ranked pair (FP, TP, 8-12 A, FN) or mean color (default: max)')
+    p.add_argument('--tile', default=0, type=int, help='Also write full resolution tiles of this many residues')
 
     args = vars(p.parse_args(sys.argv[1:]))
 
@@ -571,14 +640,7 @@ if __name__ == "__main__":
     c_filename = args['contact_file']
     psipred_filename = args['psipred_horiz']
 
-    # guessing separator of constraint file
-    line = open(c_filename,'r').readline()
-    if len(line.split(',')) != 1:
-        sep = ','
-    elif len(line.split(' ')) != 1:
-        sep = ' '
-    else:
-        sep = '\t'
-    
-    plot_map(args['fasta_file'], args['contact_file'], factor=args['factor'], th=args['threshold'], c2_filename=args['c2'], psipred_horiz_fname=args['psipred_horiz'], psipred_vert_fname=args['psipred_vert'], pdb_filename=args['pdb'], is_heavy=args['heavy'], chain=args['chain'], sep=sep, outfilename=args['outfile'], ali_filename=args['alignment'], name=args['name'], start=args['start'], end=args['end'])
+    sep = parse_contacts.guess_sep(c_filename)
+
+    plot_map(args['fasta_file'], args['contact_file'], factor=args['factor'], th=args['threshold'], c2_filename=args['c2'], psipred_horiz_fname=args['psipred_horiz'], psipred_vert_fname=args['psipred_vert'], pdb_filename=args['pdb'], is_heavy=args['heavy'], chain=args['chain'], sep=sep, outfilename=args['outfile'], ali_filename=args['alignment'], name=args['name'], start=args['start'], end=args['end'], cache_dir=args['cachedir'], ali_stat=args['alistat'], aligner=args['aligner'], large=args['large'], block=args['block'], pool=args['pool'], tile=args['tile'])
 
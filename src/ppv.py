@@ -4,57 +4,110 @@ import numpy as np
 from math import *
 
 import Bio.PDB
-from Bio import pairwise2
 
 import parse_contacts
 import parse_fasta
 import parse_pdb
+import native_cache
+import residue_map
+import distances
 
 
-def get_cb_contacts(gapped_cb_lst):
+# standard list lengths: top L/10, L/5, L/2, L and 2L contacts
+TOP_FACTORS = [('L10', 0.1), ('L5', 0.2), ('L2', 0.5), ('L', 1.0), ('2L', 2.0)]
 
-    seqlen = len(gapped_cb_lst)
-    dist_mat = np.zeros((seqlen, seqlen), np.float)
-    dist_mat.fill(float('inf'))
-    
-    for i, cb1 in enumerate(gapped_cb_lst):
-        if cb1 == '-':
-            continue
-        for j, cb2 in enumerate(gapped_cb_lst):
-            if cb2 == '-':
-                continue
-            diff_vec = cb1 - cb2
-            dist_mat[i,j] = np.sqrt(np.sum(diff_vec * diff_vec))
-    return dist_mat
 
+def label_contacts(contacts_x, contacts_y, ref_contact_map, ali_mask=None):
 
-def get_ppv_helper(contacts_x, contacts_y, ref_contact_map, ref_len, factor, atom_seq_ali=[]):
+    """Label ranked contacts as true or false positives.
+    Contacts involving residues without structure are neither.
+    @param  contacts_x      0-based residue index of first contact partner
+    @param  contacts_y      0-based residue index of second contact partner
+    @param  ref_contact_map np.array((n, n), bool) of native contacts
+    @param  ali_mask        True for residues aligned to the structure (default: all)
+    @return (TP np.array(bool), FP np.array(bool)) per contact
+    """
 
-    num_c = len(contacts_x)
-    TP = 0.0
-    FP = 0.0
-    PPV = 0.0
-    for i in range(num_c):
-        c_x = contacts_x[i]
-        c_y = contacts_y[i]
-        if atom_seq_ali:
-            if atom_seq_ali[c_x] == '-':
-                continue
-            if atom_seq_ali[c_y] == '-':
-                continue
-        if ref_contact_map[c_x, c_y] > 0:
-            TP += 1.0 / num_c
-        else:
-            FP += 1.0 / num_c
+    contacts_x = np.asarray(contacts_x, dtype=int)
+    contacts_y = np.asarray(contacts_y, dtype=int)
+    is_native = np.asarray(ref_contact_map)[contacts_x, contacts_y] > 0
+    if ali_mask is None:
+        is_aligned = np.ones(len(contacts_x), dtype=bool)
+    else:
+        ali_mask = np.asarray(ali_mask, dtype=bool)
+        is_aligned = ali_mask[contacts_x] & ali_mask[contacts_y]
+    return (is_aligned & is_native, is_aligned & ~is_native)
+
+
+def get_ppv_curve(tp, fp):
+
+    """PPV of the top k contacts for every k.
+    @param  tp  true positive labels as obtained from "label_contacts"
+    @param  fp  false positive labels
+    @return (PPV, number of TP, number of FP), arrays over k = 1..len(tp)
+            PPV is 0 as long as there is no TP
+    """
+
+    num_tp = np.cumsum(tp)
+    num_fp = np.cumsum(fp)
+    num_labeled = np.maximum(num_tp + num_fp, 1).astype(float)
+    ppv = np.where(num_tp > 0, num_tp / num_labeled, 0.0)
+    return (ppv, num_tp, num_fp)
+
+
+def get_num_top(ref_len, factor):
+    return int(ceil(ref_len * factor))
 
-    if TP > 0:
-        PPV = TP / (TP + FP)
 
-    return (PPV, TP, FP)
+def get_num_ranked(ref_len, factor=1.0, min_score=-1.0):
+    # number of contacts taken by "get_ranked_contacts", -1 for all
+    if min_score == -1.0:
+        return max(get_num_top(ref_len, factor), 1)
+    return -1
+
+
+def get_ranked_contacts(contacts, ref_len, factor=1.0, min_score=-1.0):
+
+    """Top ranked contacts with sequence separation of at least 5.
+    Without min_score, the top ref_len * factor contacts are returned,
+    otherwise all contacts down to the first one scoring below min_score.
+    @param  contacts    contact array as obtained from parse_contacts.load
+    @return (contacts_x, contacts_y, scores), 0-based residue indices
+    """
+
+    below = np.nonzero(contacts['score'] < min_score)[0]
+    if len(below) > 0:
+        contacts = contacts[:below[0] + 1]
+    contacts = contacts[np.abs(contacts['i'] - contacts['j']) >= 5]
+    num_ranked = get_num_ranked(ref_len, factor, min_score)
+    if num_ranked >= 0:
+        contacts = contacts[:num_ranked]
+    return (contacts['i'] - 1, contacts['j'] - 1, contacts['score'])
+
+
+def get_ref_contact_map(seq, pdb_filename, chain='', noalign=False, cache_dir='', aligner='pairwise2'):
+
+    """Native CB contacts (< 8 Angstroem) in the numbering of the sequence.
+    @param  aligner     aligner mapping the sequence onto the structure,
+                        see residue_map.ALIGNERS
+    @return (np.array((n, n), bool), mask of residues aligned to the structure)
+            the mask is None if noalign is set
+    """
+
+    native = native_cache.get_native(pdb_filename, chain, 'CB', cache_dir)
+    cb_cutoff = 8
+
+    if noalign:
+        return (native['dist_mat'] < cb_cutoff, None)
+
+    ali_idx = residue_map.get_map(native['atom_seq'], seq, cache_dir=cache_dir, aligner=aligner)
+    dist_mat = distances.get_gapped_dist_mat(native['dist_mat'], ali_idx)
+    return (dist_mat < cb_cutoff, ali_idx >= 0)
 
 
 def get_ppv(fasta_filename, c_filename, pdb_filename, factor=1.0,
-        min_score=-1.0, chain='', sep=' ', outfilename='', noalign=False):  
+        min_score=-1.0, chain='', sep=' ', outfilename='', noalign=False,
+        cache_dir='', presorted=False, aligner='pairwise2'):  
     
     acc = fasta_filename.split('.')[-2][-5:-1]
 
@@ -63,69 +116,69 @@ def get_ppv(fasta_filename, c_filename, pdb_filename, factor=1.0,
     ref_len = len(seq)
 
     ### get top ranked predicted contacts
-    contacts = parse_contacts.parse(open(c_filename, 'r'), sep)
-
-    contacts_x = []
-    contacts_y = []
-    scores = []
-    contact_dict = {}
-
-    count = 0
-    for i in range(len(contacts)):
-        score = contacts[i][0]
-        c_x = contacts[i][1] - 1
-        c_y = contacts[i][2] - 1
-
-        pos_diff = abs(c_x - c_y)
-        too_close = pos_diff < 5
-
-        if not too_close:
-            contacts_x.append(c_x)
-            contacts_y.append(c_y)
-            scores.append(score)
-            count += 1
-           
-        if min_score == -1.0 and count >= ref_len * factor:
-            break
-        if score < min_score:
-            break
-    
-    assert(len(contacts_x) == len(contacts_y) == len(scores))
+    num_ranked = get_num_ranked(ref_len, factor, min_score)
+    contacts = parse_contacts.load(open(c_filename, 'r'), sep, top=num_ranked, presorted=presorted)
+    contacts_x, contacts_y, scores = get_ranked_contacts(contacts, ref_len, factor, min_score)
 
-    cb_lst = parse_pdb.get_cb_coordinates(open(pdb_filename, 'r'), chain)
+    ref_contact_map, ali_mask = get_ref_contact_map(seq, pdb_filename, chain, noalign, cache_dir, aligner)
 
-    if noalign:
-        dist_mat = get_cb_contacts(cb_lst)
-        cb_cutoff = 8
-        ref_contact_map = dist_mat < cb_cutoff
-        PPV, TP, FP = get_ppv_helper(contacts_x, contacts_y, ref_contact_map, ref_len, factor)
-    else:
-        atom_seq = parse_pdb.get_atom_seq(open(pdb_filename, 'r'), chain)
-                
-        align = pairwise2.align.globalms(atom_seq, seq, 2, -1, -0.5, -0.1)
-        atom_seq_ali = align[-1][0]
-        seq_ali = align[-1][1]
-        j = 0
-        gapped_cb_lst = []
-
-        for i in xrange(len(atom_seq_ali)):
-            if atom_seq_ali[i] == '-':
-                gapped_cb_lst.append('-')
-            elif seq_ali[i] == '-':
-                j += 1
-                continue
-            else:
-                gapped_cb_lst.append(cb_lst[j])
-                j += 1
-
-        dist_mat = get_cb_contacts(gapped_cb_lst)
-        cb_cutoff = 8
-        ref_contact_map = dist_mat < cb_cutoff
-   
-        PPV, TP, FP = get_ppv_helper(contacts_x, contacts_y, ref_contact_map, ref_len, factor, atom_seq_ali=atom_seq_ali)
+    tp, fp = label_contacts(contacts_x, contacts_y, ref_contact_map, ali_mask)
+    PPV = 0.0
+    TP = 0.0
+    FP = 0.0
+    num_c = len(contacts_x)
+    if num_c > 0:
+        ppv_curve, num_tp, num_fp = get_ppv_curve(tp, fp)
+        PPV = ppv_curve[-1]
+        TP = num_tp[-1] / float(num_c)
+        FP = num_fp[-1] / float(num_c)
 
     #print '%s %s %s %s %s' % (fasta_filename, c_filename, PPV, TP, FP)
     return (c_filename, PPV, TP, FP)
+
+
+def get_top_ppvs(fasta_filename, c_filename, pdb_filename, factors=[],
+        chain='', sep=' ', noalign=False, cache_dir='', presorted=False,
+        aligner='pairwise2'):
+
+    """PPV of the top ranked contacts for several list lengths at once.
+    @param  factors     list lengths as multiples of the sequence length
+                        (default: factors of TOP_FACTORS)
+    @param  presorted   contact file is sorted by score, only read the top contacts
+    @param  aligner     see "get_ref_contact_map"
+    @return [PPV of top factor * L contacts for each factor]
+    """
+
+    if not factors:
+        factors = [top[1] for top in TOP_FACTORS]
+
+    seq = parse_fasta.read_fasta(open(fasta_filename, 'r')).values()[0][0]
+    ref_len = len(seq)
+
+    num_ranked = get_num_ranked(ref_len, max(factors))
+    contacts = parse_contacts.load(open(c_filename, 'r'), sep, top=num_ranked, presorted=presorted)
+    if len(contacts) == 0:
+        return [0.0] * len(factors)
+
+    ref_contact_map, ali_mask = get_ref_contact_map(seq, pdb_filename, chain, noalign, cache_dir, aligner)
+    return get_ranked_ppvs(contacts, ref_len, ref_contact_map, ali_mask, factors)
+
+
+def get_ranked_ppvs(contacts, ref_len, ref_contact_map, ali_mask, factors):
+
+    """PPV of the top factor * ref_len ranked contacts for each factor.
+    @param  contacts    contact array as obtained from parse_contacts.load
+    @param  ref_contact_map, ali_mask   as obtained from "get_ref_contact_map"
+    @return [PPV for each factor]
+    """
+
+    contacts_x, contacts_y, scores = get_ranked_contacts(contacts, ref_len, max(factors))
+    if len(contacts_x) == 0:
+        return [0.0] * len(factors)
+
+    tp, fp = label_contacts(contacts_x, contacts_y, ref_contact_map, ali_mask)
+    ppv_curve = get_ppv_curve(tp, fp)[0]
+    return [ppv_curve[min(get_num_top(ref_len, factor), len(ppv_curve)) - 1] for factor in factors]
   
 
 
@@ -140,27 +193,23 @@ if __name__ == "__main__":
     p.add_argument('-s', '--score', default=-1.0, type=float)
     p.add_argument('--chain', default='')
     p.add_argument('--noalign', action='store_true')
+    p.add_argument('--cachedir', default='')
+    p.add_argument('--sorted', action='store_true', help='Contact file is sorted by score, stop reading after the top contacts')
+    p.add_argument('--aligner', default='pairwise2', choices=sorted(residue_map.ALIGNERS), help='Aligner mapping the sequence onto the structure, "anchored" for long near-identical sequences (default: pairwise2)')
 
     args = vars(p.parse_args(sys.argv[1:]))
 
     fasta_filename = args['fasta_file']
     c_filename = args['contact_file']
-
-    # guessing separator of constraint file
-    line = open(c_filename,'r').readline()
-    if len(line.split(',')) != 1:
-        sep = ','
-    elif len(line.split(' ')) != 1:
-        sep = ' '
-    else:
-        sep = '\t'
+    sep = parse_contacts.guess_sep(c_filename)
     
     #if len(open(args['pdb']).readline().split(' ')) != 3:
     if True:
         get_ppv(args['fasta_file'], args['contact_file'], args['pdb'],
                 args['factor'], chain=args['chain'], sep=sep,
                 outfilename=args['outfile'], noalign=args['noalign'],
-                min_score=args['score'])
+                min_score=args['score'], cache_dir=args['cachedir'],
+                presorted=args['sorted'], aligner=args['aligner'])
     else:
         get_ppv_hbond(args['fasta_file'], args['contact_file'],
                 args['pdb'], args['factor'], sep=sep,
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shlex
+import time
+import atexit
+import select
+import argparse
+import subprocess
+
+import gdca
+
+
+# Line protocol between evaluate and a long-running predictor worker.
+# Requests are written to the worker's stdin, replies are read from its
+# stdout, fields are separated by tabs, one request or reply per line:
+#
+#   PING                                     -> PONG
+#   PREDICT  trimmed file  cm file  neff file -> OK | ERROR  message
+#   QUIT or end of input                     -> worker exits
+#
+# PREDICT writes the contact map to cm file and the number of effective
+# sequences to neff file. Workers must not print anything else to stdout.
+
+WORKDIR = os.path.dirname(os.path.realpath(__file__))
+
+# seconds to wait for PONG, after start the worker may still be loading
+PING_TIMEOUT = 10.
+STARTUP_TIMEOUT = 600.
+# restarts of a crashed worker per job
+MAX_RESTARTS = 1
+
+# running workers of this process: {command: Worker}
+WORKERS = {}
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+class Worker(object):
+
+    """Client of a predictor worker process, restarted when it crashes."""
+
+    def __init__(self, command):
+
+        """@param  command     worker command line, e.g. "julia gdca_worker.jl"
+        """
+
+        self.command = command
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(shlex.split(self.command),
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        if not self.ping(STARTUP_TIMEOUT):
+            self.stop()
+            raise WorkerError('Worker "%s" did not answer after start' % self.command)
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def send(self, fields):
+        self.proc.stdin.write('\t'.join(fields) + '\n')
+        self.proc.stdin.flush()
+
+    def receive(self, timeout=None):
+
+        """Read one reply line.
+        @param  timeout     seconds to wait for the reply (default: no limit)
+        @return [fields]
+        """
+
+        if timeout is not None:
+            if not select.select([self.proc.stdout], [], [], timeout)[0]:
+                raise WorkerError('Worker "%s" did not answer within %d seconds' % (self.command, timeout))
+        line = self.proc.stdout.readline()
+        if not line:
+            raise WorkerError('Worker "%s" exited with code %s' % (self.command, self.proc.wait()))
+        return line.rstrip('\n').split('\t')
+
+    def ping(self, timeout=PING_TIMEOUT):
+
+        """Health check.
+        @return True if the worker answered in time
+        """
+
+        if not self.is_alive():
+            return False
+        try:
+            self.send(['PING'])
+            return self.receive(timeout) == ['PONG']
+        except (IOError, OSError, WorkerError):
+            return False
+
+    def predict(self, trimmed_aln_file, cm_file, neff_file):
+
+        """Run one prediction job.
+        A worker that does not answer the health check or dies during the
+        job is restarted and the job is run again, at most MAX_RESTARTS times.
+        @raise  WorkerError if the prediction failed
+        """
+
+        error = ''
+        for attempt in range(MAX_RESTARTS + 1):
+            if not self.ping():
+                self.stop()
+                self.start()
+            try:
+                self.send(['PREDICT', trimmed_aln_file, cm_file, neff_file])
+                reply = self.receive()
+            except (IOError, OSError, WorkerError) as e:
+                error = str(e)
+                self.stop()
+                continue
+            if reply[0] == 'OK':
+                return
+            raise WorkerError('Prediction for %s failed: %s' % (trimmed_aln_file, ' '.join(reply[1:])))
+        raise WorkerError('Prediction for %s failed: %s' % (trimmed_aln_file, error))
+
+    def stop(self):
+
+        """Ask the worker to quit, kill it if it does not."""
+
+        if self.proc is None:
+            return
+        if self.is_alive():
+            try:
+                self.send(['QUIT'])
+                self.proc.stdin.close()
+            except (IOError, OSError):
+                pass
+            for i in range(50):
+                if self.proc.poll() is not None:
+                    break
+                time.sleep(0.1)
+            else:
+                self.proc.kill()
+        self.proc.wait()
+        self.proc = None
+
+
+def get_worker(command):
+
+    """Worker for given command, started once per process."""
+
+    if command not in WORKERS:
+        WORKERS[command] = Worker(command)
+    return WORKERS[command]
+
+
+@atexit.register
+def stop_workers():
+    for worker in WORKERS.values():
+        worker.stop()
+
+
+def serve(predict, infile=sys.stdin, outfile=sys.stdout):
+
+    """Answer protocol requests until QUIT or end of input.
+    @param  predict     function(trimmed file, cm file, neff file),
+                        raising an exception on failure
+    """
+
+    for line in iter(infile.readline, ''):
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == 'QUIT':
+            break
+        elif fields[0] == 'PING':
+            reply = ['PONG']
+        elif fields[0] == 'PREDICT' and len(fields) == 4:
+            try:
+                predict(*fields[1:])
+                reply = ['OK']
+            except Exception as e:
+                reply = ['ERROR', ' '.join(('%s: %s' % (type(e).__name__, e)).split())]
+        else:
+            reply = ['ERROR', 'Unknown request %s' % fields[0]]
+        outfile.write('\t'.join(reply) + '\n')
+        outfile.flush()
+
+
+def run_predictor(cmd, trimmed_aln_file, cm_file, neff_file):
+    # predictors like run_gdca.sh write the neff file themselves
+    ret = subprocess.call([cmd, trimmed_aln_file, cm_file], stdout=sys.stderr)
+    if ret != 0:
+        raise WorkerError('%s exited with code %d' % (cmd, ret))
+    if not os.path.isfile(cm_file) or os.stat(cm_file).st_size == 0:
+        raise WorkerError('%s did not write %s' % (cmd, cm_file))
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Stand-in predictor worker\
+            speaking the worker protocol on stdin/stdout. Runs the given\
+            contact predictor for every job, e.g. for testing.')
+    p.add_argument('-c', '--contact', default='%s/run_gdca.sh' % WORKDIR, help='Path to contact predictor executable or "gdca" for the built-in GaussDCA')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    if args['contact'] == 'gdca':
+        serve(gdca.predict)
+    else:
+        serve(lambda *files: run_predictor(args['contact'], *files))
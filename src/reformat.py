@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import argparse
+import tempfile
+import itertools
+import numpy as np
+
+import a3m_to_trimmed
+
+
+# Built-in replacement of "reformat.pl INFORMAT a3m infile outfile" from
+# HHsuite: match states are the columns with a residue in the first sequence
+# (-M first), secondary structure lines (ss_) are kept, aa_ and sa_ lines
+# are skipped, sequences without residues are removed.
+
+INFORMATS = ['fas', 'a2m', 'sto', 'clu', 'psi']
+FASTA_EXT = {'fa': 'fas', 'fas': 'fas', 'fasta': 'fas', 'afa': 'fas', 'a2m': 'a2m', 'a3m': 'a3m'}
+
+# residues per line and maximal name length of the a3m output
+NUMRES = 100
+DESCLEN = 1000
+
+NOT_RESIDUE = re.compile(r'[^A-Za-z0-9.~-]')
+HTML_TAG = re.compile(r'<[A-Za-z/].*?>')
+BLOCK_LINE = re.compile(r'^(\S+)\s+([ a-zA-Z0-9.-]+?)(\s+\d+)?$')
+
+# column state translation, match columns: '.' -> '-', residues upper case;
+# insert columns: '-' -> '.', residues lower case
+MATCH_STATES = np.arange(256, dtype=np.uint8)
+MATCH_STATES[ord('a'):ord('z') + 1] -= 32
+MATCH_STATES[ord('.')] = ord('-')
+INSERT_STATES = np.arange(256, dtype=np.uint8)
+INSERT_STATES[ord('A'):ord('Z') + 1] += 32
+INSERT_STATES[ord('-')] = ord('.')
+
+
+def sniff_format(aln_filename, num_lines=100):
+
+    """Guess alignment format from file content.
+    Files starting with a name line are told apart by extension (default:
+    'a2m' if the first lines contain lower case residues, otherwise 'fas'),
+    files without format header or name lines are taken as PSI-BLAST
+    whatever their extension.
+    @return one of INFORMATS or 'a3m'
+    """
+
+    with open(aln_filename, 'r') as afile:
+        lines = [l for l in itertools.islice(afile, num_lines) if l.strip()]
+    if not lines:
+        raise ValueError('%s is empty' % aln_filename)
+    if lines[0].startswith('# STOCKHOLM'):
+        return 'sto'
+    if 'CLUSTAL' in lines[0].upper():
+        return 'clu'
+    lines = [l for l in lines if not l.startswith('#')]
+    ext = aln_filename.split('.')[-1].lower()
+    if lines and lines[0].startswith('>'):
+        if ext in FASTA_EXT:
+            return FASTA_EXT[ext]
+        if any(c.islower() for l in lines if not l.startswith('>') for c in l):
+            return 'a2m'
+        return 'fas'
+    return 'psi'
+
+
+def read_fasta(lines, root_name=''):
+
+    """Sequences of fas/a2m file.
+    @param  lines       lines of alignment file, without title line
+    @param  root_name   name of residues before the first name line
+    @return generator of (name, residues)
+    """
+
+    # residues in front of the first name line belong to root_name
+    name = root_name
+    residues = []
+    n = 0
+    for line in lines:
+        if line.startswith('>'):
+            if n or residues:
+                yield (name, ''.join(residues))
+            # '>' within the name line is dropped
+            name = line[1:].rstrip('\n').replace('>', '').lstrip() or str(n)
+            residues = []
+            n += 1
+        elif not line.startswith('#'):
+            residues.append(line)
+    if n or residues:
+        yield (name, ''.join(residues))
+
+
+def read_stockholm(lines):
+
+    """Sequences of Stockholm file, #=GC SS_cons is read as ss_dssp.
+    @return [(name, residues)]
+    """
+
+    names = []
+    seqs = {}
+    first_block = True
+    for line in lines:
+        line = ' '.join(line.split()) + ' '
+        if line.startswith('#=GC SS_cons'):
+            line = 'ss_dssp' + line[len('#=GC SS_cons'):]
+        if line.startswith('#'):
+            continue
+        if line.startswith('//'):
+            break
+        if not line.strip():
+            first_block = False
+            continue
+        fields = line.split()
+        if len(fields) < 2:
+            raise ValueError('Line in Stockholm format without residues: %s' % line.strip())
+        name, residues = fields[:2]
+        if name not in seqs:
+            if name.startswith('aa_') or name.startswith('sa_'):
+                continue
+            names.append(name)
+            seqs[name] = [residues]
+            first_block = True
+        elif first_block:
+            raise ValueError('Sequence %s appears more than once per block' % name)
+        else:
+            seqs[name].append(residues)
+    return [(name, ''.join(seqs[name])) for name in names]
+
+
+def read_blocks(lines, informat='clu'):
+
+    """Sequences of interleaved Clustal or PSI-BLAST file.
+    @return [(name, residues)]
+    """
+
+    names = []
+    seqs = []
+    num_seqs = 0
+    k = 0
+    block = 1
+    residues_per_line = 50
+    for line_num, line in enumerate(lines, 1):
+        line = line.replace('\r', '').rstrip('\n')
+        if informat == 'clu':
+            if 'CLUSTAL' in line.upper() or line.startswith('#'):
+                continue
+            if line.startswith('//'):
+                break
+        if not line.strip():
+            # new sequence block starts
+            if k:
+                if num_seqs and num_seqs != k:
+                    raise ValueError('Different number of sequences in blocks 1 and %d' % block)
+                block += 1
+                num_seqs = k
+                k = 0
+            continue
+
+        match = BLOCK_LINE.match(line)
+        if match:
+            if line.startswith('aa_') or line.startswith('sa_'):
+                continue
+            name, residues = match.group(1), match.group(2).replace(' ', '')
+            residues_per_line = len(residues)
+        elif informat == 'clu':
+            if re.match(r'^[*.: ]*$', line):
+                continue
+            # no space between name and residues (SMART)
+            match = re.match(r'^(\S{1,20})([a-zA-Z0-9.-]{%d})(\s+\d+)?$' % residues_per_line, line)
+            if not match:
+                raise ValueError('Line %d not in Clustal format: %s' % (line_num, line))
+            name, residues = match.group(1), match.group(2)
+        else:
+            raise ValueError('Line %d not in PSI-BLAST format: %s' % (line_num, line))
+
+        if block == 1:
+            names.append(name)
+            seqs.append([residues])
+        elif k < len(seqs):
+            seqs[k].append(residues)
+        else:
+            raise ValueError('Different number of sequences in blocks 1 and %d' % block)
+        k += 1
+
+    if k and num_seqs and num_seqs != k:
+        raise ValueError('Different number of sequences in blocks 1 and %d' % block)
+    return [(name, ''.join(seq)) for name, seq in zip(names, seqs)]
+
+
+def is_annotation(name):
+    return name.startswith('ss_') or name.startswith('aa_') or name.startswith('sa_')
+
+
+def to_a3m(records, informat='fas'):
+
+    """Convert sequences into a3m, match states from the first sequence.
+    Sequences are converted as they come, only annotation lines in front
+    of the first sequence are kept in memory.
+    @param  records     (name, residues) as obtained from the read functions
+    @param  informat    residues of 'a2m' input keep their case
+    @return generator of (name, a3m residues)
+    """
+
+    match = None
+    pending = []
+    for name, residues in records:
+        if name[:3] in ('aa_', 'sa_'):
+            continue
+        if informat != 'a2m':
+            residues = residues.upper()
+        residues = NOT_RESIDUE.sub('', residues).replace('~', '-')
+        if match is None:
+            pending.append((name, residues))
+            if is_annotation(name):
+                continue
+            match = np.array([c not in '.-' for c in residues], dtype=bool)
+        else:
+            pending = [(name, residues)]
+
+        for name, residues in pending:
+            states = np.frombuffer(residues, dtype=np.uint8)
+            is_match = np.zeros(len(states), dtype=bool)
+            num_match = min(len(states), len(match))
+            is_match[:num_match] = match[:num_match]
+            states = np.where(is_match, MATCH_STATES[states], INSERT_STATES[states])
+            residues = states[states != ord('.')].tostring()
+            if not re.search('[a-zA-Z0-9]', residues):
+                # only gaps
+                continue
+            yield (HTML_TAG.sub('', name[:DESCLEN]), residues)
+        pending = []
+
+    if match is None:
+        # annotation lines only, no sequence to define match states
+        for name, residues in pending:
+            yield (HTML_TAG.sub('', name[:DESCLEN]), residues)
+
+
+def read(aln_filename, informat=''):
+
+    """Read alignment as a3m sequences.
+    @param  informat    one of INFORMATS (default: guessed from content)
+    @return (title line or '', generator of (name, a3m residues))
+    """
+
+    if not informat:
+        informat = sniff_format(aln_filename)
+    if informat not in INFORMATS:
+        raise ValueError('Cannot convert %s from format %s, use one of %s' %
+                (aln_filename, informat, ', '.join(INFORMATS)))
+
+    afile = open(aln_filename, 'r')
+    titleline = ''
+    if informat in ('fas', 'a2m'):
+        first = afile.readline()
+        lines = afile
+        if first.startswith('#'):
+            titleline = first.rstrip('\n')
+        else:
+            lines = itertools.chain([first], afile)
+        root_name = os.path.basename(aln_filename).split('.')[0]
+        records = read_fasta(lines, root_name)
+    elif informat == 'sto':
+        records = read_stockholm(afile)
+    else:
+        records = read_blocks(afile, informat)
+    return (titleline, to_a3m(records, informat))
+
+
+def get_a3m_lines(titleline, records):
+
+    """Lines of a3m file, NUMRES residues per line."""
+
+    if titleline:
+        yield titleline + '\n'
+    for name, residues in records:
+        yield '>%s\n' % name
+        for i in range(0, len(residues), NUMRES):
+            yield residues[i:i + NUMRES] + '\n'
+        if len(residues) % NUMRES == 0:
+            yield '\n'
+
+
+def reformat(aln_filename, outfilename, informat='', trimmed=False):
+
+    """Convert alignment to a3m (or trimmed) format.
+    The output file is only created if the conversion succeeded.
+    @param  informat    one of INFORMATS (default: guessed from content)
+    @param  trimmed     write trimmed format (as a3m_to_trimmed) instead of a3m
+    @raise  ValueError  on unknown or malformed input
+    @return number of sequences written
+    """
+
+    titleline, records = read(aln_filename, informat)
+    num_seqs = [0]
+
+    def count(records):
+        for record in records:
+            num_seqs[0] += 1
+            yield record
+
+    lines = get_a3m_lines(titleline, count(records))
+    if trimmed:
+        lines = a3m_to_trimmed.convert_lines(lines)
+
+    outdir = os.path.dirname(os.path.abspath(outfilename))
+    tmp = tempfile.NamedTemporaryFile('w', dir=outdir, prefix='.%s.' % os.path.basename(outfilename), delete=False)
+    try:
+        for line in lines:
+            tmp.write(line)
+        tmp.close()
+        if num_seqs[0] == 0:
+            raise ValueError('%s contains no sequences' % aln_filename)
+        os.rename(tmp.name, outfilename)
+    finally:
+        if os.path.exists(tmp.name):
+            tmp.close()
+            os.remove(tmp.name)
+    return num_seqs[0]
+
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser(description='Convert alignment to a3m\
+            format, like reformat.pl INFORMAT a3m infile outfile.')
+    p.add_argument('infile', help='Input alignment (fas, a2m, sto, clu or psi)')
+    p.add_argument('outfile', help='Output a3m file')
+    p.add_argument('-i', '--informat', default='', choices=INFORMATS, help='Input format (default: guessed from content)')
+    p.add_argument('-t', '--trimmed', action='store_true', help='Write trimmed format instead of a3m')
+
+    args = vars(p.parse_args(sys.argv[1:]))
+    try:
+        reformat(args['infile'], args['outfile'], args['informat'], args['trimmed'])
+    except (IOError, ValueError) as e:
+        sys.exit('ERROR: %s' % e)
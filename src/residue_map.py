@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+import os
+import numpy as np
+
+from Bio import pairwise2
+
+import cache
+
+
+# Mapping of sequence positions onto the residues of a native structure, as
+# index array: native residue index per sequence position, -1 for positions
+# without structure. It only depends on the two sequences and the scoring,
+# so it is computed once per process and, with a cache directory, stored on
+# disk. Identical sequences and sequences contained once in the other one
+# are mapped directly, otherwise they are aligned globally with pairwise2
+# (last of the optimal alignments) or, for long near-identical sequences,
+# by the anchored aligner: exact matches of k-mers occurring once in both
+# sequences are taken as aligned, only the segments between them are
+# aligned, within a band around their diagonal.
+
+# bump when the stored mapping changes meaning
+VERSION = '1'
+# match, mismatch, gap open, gap extend
+SCORING = (2, -1, -0.5, -0.1)
+
+# anchor length and band width (in residues beyond the length difference
+# of the segments) of the anchored aligner
+ANCHOR_K = 8
+BAND = 10
+
+# in-process cache of the most recently used mappings:
+# {(atom_seq, seq, scoring, aligner): ali_idx}
+MAX_MAPS = 256
+MAPS = cache.LRU(MAX_MAPS)
+
+
+def get_ali_idx(atom_seq_ali, seq_ali):
+
+    """Map sequence positions onto native residues.
+    @param  atom_seq_ali    aligned atom sequence
+    @param  seq_ali         aligned sequence
+    @return np.array(len(seq)) native residue index or -1 for each sequence position
+    """
+
+    atom_gaps = np.frombuffer(atom_seq_ali, dtype=np.uint8) == ord('-')
+    seq_gaps = np.frombuffer(seq_ali, dtype=np.uint8) == ord('-')
+    native_idx = np.cumsum(~atom_gaps) - 1
+    keep = atom_gaps | ~seq_gaps
+    return np.where(atom_gaps[keep], -1, native_idx[keep])
+
+
+def get_direct_map(atom_seq, seq):
+
+    """Mapping without alignment if one sequence occurs exactly once in the other.
+    @return np.array(len(seq)) or None
+    """
+
+    if seq in atom_seq:
+        start = atom_seq.find(seq)
+        if atom_seq.rfind(seq) == start:
+            return np.arange(start, start + len(seq))
+    elif atom_seq in seq:
+        start = seq.find(atom_seq)
+        if seq.rfind(atom_seq) == start:
+            ali_idx = np.empty(len(seq), dtype=int)
+            ali_idx.fill(-1)
+            ali_idx[start:start + len(atom_seq)] = np.arange(len(atom_seq))
+            return ali_idx
+    return None
+
+
+def align(atom_seq, seq, scoring=SCORING):
+    alignment = pairwise2.align.globalms(atom_seq, seq, *scoring)[-1]
+    return get_ali_idx(alignment[0], alignment[1])
+
+
+def get_anchors(atom_seq, seq, k=ANCHOR_K):
+
+    """Exact matches of k-mers occurring once in each sequence, merged into
+    runs on the same diagonal. Runs overlapping the previous run are cut.
+    @return [(sequence start, atom sequence start, length)] by sequence start,
+            None if the runs are not in the same order in both sequences
+    """
+
+    def get_unique_kmers(s):
+        kmers = {}
+        for i in xrange(len(s) - k + 1):
+            kmer = s[i:i + k]
+            kmers[kmer] = -1 if kmer in kmers else i
+        return kmers
+
+    atom_kmers = get_unique_kmers(atom_seq)
+    seq_kmers = get_unique_kmers(seq)
+    pairs = sorted([(i, atom_kmers[kmer]) for kmer, i in seq_kmers.iteritems()
+            if i >= 0 and atom_kmers.get(kmer, -1) >= 0])
+
+    runs = []
+    for i, j in pairs:
+        cut = 0
+        if runs:
+            start, atom_start, length = runs[-1]
+            if j < atom_start:
+                return None
+            if i - start == j - atom_start and i <= start + length:
+                runs[-1] = (start, atom_start, i + k - start)
+                continue
+            cut = max(start + length - i, atom_start + length - j, 0)
+            if cut >= k:
+                continue
+        runs.append((i + cut, j + cut, k - cut))
+    return runs
+
+
+def align_banded(atom_seq, seq, scoring=SCORING, band=BAND):
+
+    """Global alignment with affine gap costs restricted to a band of
+    diagonals, like pairwise2.align.globalms.
+    @param  band    diagonals beyond the length difference of the sequences
+    @return np.array(len(seq)) atom sequence index or -1 for each sequence position
+    """
+
+    match, mismatch, gap_open, gap_extend = scoring
+    n, m = len(seq), len(atom_seq)
+    ali_idx = np.empty(n, dtype=int)
+    ali_idx.fill(-1)
+    if n == 0 or m == 0:
+        return ali_idx
+
+    # cell (i, j) is stored at column k = j - i - lowest diagonal; best score
+    # of the cell ending in a match (state 0), a sequence residue against a
+    # gap (1) or an atom residue against a gap (2), and the previous state
+    lowest = min(0, m - n) - band
+    width = max(0, m - n) + band - lowest + 1
+    neg = float('-inf')
+    score = [[[neg] * width for state in range(3)] for i in xrange(n + 1)]
+    back = [[[0] * width for state in range(3)] for i in xrange(n + 1)]
+    for i in xrange(n + 1):
+        cur = score[i]
+        cur_back = back[i]
+        prev = score[i - 1] if i > 0 else None
+        for k in xrange(max(0, -i - lowest), min(width, m - i - lowest + 1)):
+            j = i + lowest + k
+            if i == 0 and j == 0:
+                cur[0][k] = 0.
+                continue
+            if i > 0 and j > 0:
+                best = 0
+                for state in (1, 2):
+                    if prev[state][k] > prev[best][k]:
+                        best = state
+                cur[0][k] = prev[best][k] + (match if seq[i - 1] == atom_seq[j - 1] else mismatch)
+                cur_back[0][k] = best
+            if i > 0 and k + 1 < width:
+                best, best_score = 0, prev[0][k + 1] + gap_open
+                if prev[1][k + 1] + gap_extend > best_score:
+                    best, best_score = 1, prev[1][k + 1] + gap_extend
+                if prev[2][k + 1] + gap_open > best_score:
+                    best, best_score = 2, prev[2][k + 1] + gap_open
+                cur[1][k], cur_back[1][k] = best_score, best
+            if j > 0 and k > 0:
+                best, best_score = 0, cur[0][k - 1] + gap_open
+                if cur[1][k - 1] + gap_open > best_score:
+                    best, best_score = 1, cur[1][k - 1] + gap_open
+                if cur[2][k - 1] + gap_extend > best_score:
+                    best, best_score = 2, cur[2][k - 1] + gap_extend
+                cur[2][k], cur_back[2][k] = best_score, best
+
+    i, k = n, m - n - lowest
+    state = 0
+    for s in (1, 2):
+        if score[n][s][k] > score[n][state][k]:
+            state = s
+    while i > 0 or i + lowest + k > 0:
+        prev_state = back[i][state][k]
+        if state == 0:
+            ali_idx[i - 1] = i + lowest + k - 1
+            i -= 1
+        elif state == 1:
+            i -= 1
+            k += 1
+        else:
+            k -= 1
+        state = prev_state
+    return ali_idx
+
+
+def align_anchored(atom_seq, seq, scoring=SCORING):
+
+    """Alignment of the segments between anchors (see "get_anchors") by
+    "align_banded", full alignment if the anchors are missing or not in
+    the same order in both sequences.
+    @return np.array(len(seq)) as obtained from "get_ali_idx"
+    """
+
+    runs = get_anchors(atom_seq, seq)
+    if not runs:
+        return align(atom_seq, seq, scoring)
+    ali_idx = np.empty(len(seq), dtype=int)
+    ali_idx.fill(-1)
+    seq_end = atom_end = 0
+    for start, atom_start, length in runs + [(len(seq), len(atom_seq), 0)]:
+        segment_idx = align_banded(atom_seq[atom_end:atom_start], seq[seq_end:start], scoring)
+        ali_idx[seq_end:start] = np.where(segment_idx >= 0, segment_idx + atom_end, -1)
+        ali_idx[start:start + length] = np.arange(atom_start, atom_start + length)
+        seq_end, atom_end = start + length, atom_start + length
+    return ali_idx
+
+
+# {name: function(atom_seq, seq, scoring) -> ali_idx}
+ALIGNERS = {'pairwise2': align, 'anchored': align_anchored}
+
+
+def get_key(atom_seq, seq, scoring=SCORING, aligner='pairwise2'):
+    return cache.get_key('resmap', VERSION, atom_seq, seq, aligner, *scoring)
+
+
+def save(ali_idx, cache_dir, key):
+    tmp_path = cache.make_tmp(cache_dir, 'resmap', key)
+    np.save(os.path.join(tmp_path, 'ali_idx.npy'), ali_idx)
+    cache.commit(tmp_path, cache.get_path(cache_dir, 'resmap', key))
+
+
+def get_map(atom_seq, seq, scoring=SCORING, cache_dir='', aligner='pairwise2'):
+
+    """Native residue index per sequence position, -1 for positions without
+    structure. The MAX_MAPS most recently used results are kept in memory
+    and, if cache_dir is given, stored on disk keyed by both sequences, the
+    scoring and the aligner.
+    @param  atom_seq    sequence of the native structure
+    @param  seq         query sequence
+    @param  scoring     match, mismatch, gap open and gap extend scores
+    @param  cache_dir   persistent cache root directory (default: none)
+    @param  aligner     one of ALIGNERS, used unless one sequence occurs
+                        exactly once in the other
+    @return np.array(len(seq)), read-only
+    """
+
+    if aligner not in ALIGNERS:
+        raise ValueError('Unknown aligner "%s", use one of %s' % (aligner, ', '.join(sorted(ALIGNERS))))
+    mem_key = (atom_seq, seq, tuple(scoring), aligner)
+    if mem_key in MAPS:
+        return MAPS[mem_key]
+
+    align_func = ALIGNERS[aligner]
+    ali_idx = get_direct_map(atom_seq, seq)
+    if ali_idx is None and cache_dir:
+        key = get_key(atom_seq, seq, scoring, aligner)
+        path = os.path.join(cache.get_path(cache_dir, 'resmap', key), 'ali_idx.npy')
+        if not os.path.isfile(path):
+            save(align_func(atom_seq, seq, scoring), cache_dir, key)
+        ali_idx = np.load(path)
+    elif ali_idx is None:
+        ali_idx = align_func(atom_seq, seq, scoring)
+
+    ali_idx.flags.writeable = False
+    MAPS[mem_key] = ali_idx
+    return ali_idx